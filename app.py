@@ -1,54 +1,126 @@
 import os
+import threading
 from flask import Flask
+from flask_compress import Compress
+from jinja2 import FileSystemBytecodeCache
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from loguru import logger
-from config import Config
-from models import db
+from sqlalchemy import event
+from config import Config, get_config
+from models import db, init_search_indexes
+from utils.json_provider import ORJSONProvider
 
-# Configure logger
-logger.add("logs/app.log", rotation="10 MB", retention="30 days", level="INFO")
+_logging_configured = False
 
-def create_app():
-    """Create and configure the Flask application."""
+def _configure_logging():
+    """Attach the rotating file sink once per process."""
+    global _logging_configured
+    if _logging_configured:
+        return
+    os.makedirs('logs', exist_ok=True)
+    # enqueue=True moves file writes to a background thread
+    logger.add("logs/app.log", rotation="10 MB", retention="30 days", level="INFO", enqueue=True)
+    _logging_configured = True
+
+def _limiter_storage_options():
+    """Build storage options for the rate limiter backend."""
+    uri = Config.RATE_LIMIT_STORAGE_URI
+    if not uri.startswith(('redis://', 'rediss://')):
+        return {}
+    import redis
+    # Blocking pool keeps a bounded set of persistent sockets for the limiter scripts
+    pool = redis.BlockingConnectionPool.from_url(
+        uri, max_connections=Config.RATE_LIMIT_REDIS_MAX_CONNECTIONS
+    )
+    return {'connection_pool': pool}
+
+def _configure_sqlite(engine):
+    """Enable WAL journaling so readers don't block on message-log writes."""
+    if not engine.url.drivername.startswith('sqlite'):
+        return
+    
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragma(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.close()
+
+def _configure_templates(app):
+    """Reuse compiled templates across restarts and skip mtime checks outside development."""
+    cache_dir = Config.TEMPLATE_BYTECODE_CACHE_DIR
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    if Config.FLASK_ENV == 'production':
+        app.jinja_env.auto_reload = False
+
+def _warm_ai_service():
+    from services.ai import get_ai_service
+    get_ai_service().warmup()
+
+def create_app(register_routes=True, start_scheduler=True):
+    """Create and configure the Flask application.
+
+    Args:
+        register_routes: Register the web/API blueprints
+        start_scheduler: Start APScheduler and restore pending jobs
+    """
     app = Flask(__name__)
+    app.json = ORJSONProvider(app)
     
     # Load configuration
-    app.config.from_object(Config)
-    Config.validate()
+    app.config.from_object(get_config())
+    _configure_logging()
+    _configure_templates(app)
     
     # Initialize database
     db.init_app(app)
     
+    # gzip/brotli responses for clients that accept it; streamed bodies stay streamed
+    app.config.setdefault('COMPRESS_STREAMS', False)
+    Compress(app)
+    
     # Initialize rate limiter
     limiter = Limiter(
         app=app,
         key_func=get_remote_address,
         default_limits=[Config.RATE_LIMIT_DEFAULT],
-        storage_uri="memory://"
+        storage_uri=Config.RATE_LIMIT_STORAGE_URI,
+        storage_options=_limiter_storage_options(),
+        strategy=Config.RATE_LIMIT_STRATEGY,
+        in_memory_fallback_enabled=True
     )
     
     # Store limiter in app context for use in routes
     app.limiter = limiter
     
     # Register blueprints
-    from routes import main_bp
-    app.register_blueprint(main_bp)
+    if register_routes:
+        from routes import main_bp
+        app.register_blueprint(main_bp)
+        # Import the AI client and do its TLS handshake off the request path, without delaying startup
+        threading.Thread(target=_warm_ai_service, name='ai-warmup', daemon=True).start()
     
     # Ensure database tables exist and initialize scheduler
     with app.app_context():
+        _configure_sqlite(db.engine)
         db.create_all()
+        init_search_indexes(db.engine)
         logger.info("Database tables ready")
         # Initialize APScheduler and restore jobs
-        from services.scheduler import init_scheduler
-        init_scheduler(app)
+        if start_scheduler:
+            from services.scheduler import init_scheduler
+            init_scheduler(app)
     
     return app
 
 def init_db_cli():
     """Initialize database from CLI."""
-    app = create_app()
+    app = create_app(register_routes=False, start_scheduler=False)
     with app.app_context():
+        _configure_sqlite(db.engine)
         db.create_all()
         print("Database initialized successfully!")
 
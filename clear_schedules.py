@@ -1,26 +1,36 @@
 #!/usr/bin/env python
 """Script para limpar todos os agendamentos e parar envios de mensagens."""
 
-from app import create_app, db
-from models import ScheduledMessage
-from services.scheduler import scheduler
+from flask import Flask
+from config import Config
+from models import db, ScheduledMessage
 from loguru import logger
 
+def _create_minimal_app():
+    """Cria um app mínimo, sem blueprints nem scheduler."""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    return app
+
 def clear_all_schedules():
     """Remove todos os agendamentos do banco e do scheduler."""
-    app = create_app()
+    app = _create_minimal_app()
     
     with app.app_context():
+        from services.scheduler import scheduler, create_scheduler
+        if scheduler is None:
+            # Abre o jobstore persistente sem executar nenhum job
+            scheduler = create_scheduler()
+            scheduler.start(paused=True)
         try:
             # Remover todos os jobs do scheduler
             if scheduler:
                 try:
-                    # Remover todos os jobs
-                    jobs = scheduler.get_jobs()
-                    for job in jobs:
-                        logger.info(f"Removendo job: {job.id}")
-                        scheduler.remove_job(job.id)
-                    logger.info(f"Total de {len(jobs)} jobs removidos do scheduler")
+                    # Remover todos os jobs em uma única operação
+                    total_jobs = len(scheduler.get_jobs())
+                    scheduler.remove_all_jobs()
+                    logger.info(f"Total de {total_jobs} jobs removidos do scheduler")
                 except Exception as e:
                     logger.error(f"Erro ao remover jobs do scheduler: {e}")
                 
@@ -31,14 +41,8 @@ def clear_all_schedules():
                 except Exception as e:
                     logger.error(f"Erro ao parar scheduler: {e}")
             
-            # Limpar todos os agendamentos do banco
-            schedules = ScheduledMessage.query.all()
-            count = len(schedules)
-            
-            for schedule in schedules:
-                logger.info(f"Removendo agendamento ID: {schedule.id}, Job ID: {schedule.job_id}")
-                db.session.delete(schedule)
-            
+            # Limpar todos os agendamentos do banco com um único DELETE
+            count = ScheduledMessage.query.delete(synchronize_session=False)
             db.session.commit()
             logger.info(f"Total de {count} agendamentos removidos do banco de dados")
             
@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -10,29 +11,53 @@ class Config:
     # Flask configuration
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev_secret_key_default')
     FLASK_ENV = os.getenv('FLASK_ENV', 'development')
+    # Compiled Jinja templates are kept here across restarts; empty disables the cache
+    TEMPLATE_BYTECODE_CACHE_DIR = os.getenv('TEMPLATE_BYTECODE_CACHE_DIR', os.path.join('instance', 'jinja_cache'))
     
     # Database configuration
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///database.db')
     SQLALCHEMY_DATABASE_URI = DATABASE_URL
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection pool configuration
+    if DATABASE_URL.startswith('sqlite'):
+        # File-backed SQLite gains nothing from pool sizing; allow use from scheduler threads
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            'connect_args': {'check_same_thread': False},
+        }
+    else:
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 20)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+            'pool_timeout': 30,
+            'pool_recycle': 1800,
+            'pool_pre_ping': True,
+            # Reuse the most recently returned connection so a hot subset stays warm
+            'pool_use_lifo': True,
+        }
+    
     # Z-API configuration
     ZAPI_INSTANCE_ID = os.getenv('ZAPI_INSTANCE_ID')
     ZAPI_INSTANCE_TOKEN = os.getenv('ZAPI_INSTANCE_TOKEN')
     ZAPI_SEND_TEXT_URL = os.getenv('ZAPI_SEND_TEXT_URL')
     ZAPI_CLIENT_TOKEN = os.getenv('ZAPI_CLIENT_TOKEN')  # Optional: some Z-API setups require this header
     
-    # Build Z-API URL if not provided
-    if not ZAPI_SEND_TEXT_URL and ZAPI_INSTANCE_ID and ZAPI_INSTANCE_TOKEN:
-        ZAPI_SEND_TEXT_URL = (
-            f"https://api.z-api.io/instances/{ZAPI_INSTANCE_ID}/"
-            f"token/{ZAPI_INSTANCE_TOKEN}/send-text"
-        )
-    
     # Rate limiting configuration
     RATE_LIMIT_DEFAULT = os.getenv('RATE_LIMIT_DEFAULT', '30 per minute')
     RATE_LIMIT_SEND = os.getenv('RATE_LIMIT_SEND', '10 per minute')
     RATE_LIMIT_BULK = os.getenv('RATE_LIMIT_BULK', '2 per minute')
+    # Shared storage so counters are consistent across workers (use memory:// for local dev)
+    RATE_LIMIT_STORAGE_URI = os.getenv('RATE_LIMIT_STORAGE_URI', 'redis://localhost:6379/0')
+    RATE_LIMIT_STRATEGY = os.getenv('RATE_LIMIT_STRATEGY', 'moving-window')
+    RATE_LIMIT_REDIS_MAX_CONNECTIONS = int(os.getenv('RATE_LIMIT_REDIS_MAX_CONNECTIONS', 32))
+    
+    # Bulk-send job status store; defaults to the rate limiter's Redis (memory:// keeps it in-process)
+    JOB_STORE_URI = os.getenv('JOB_STORE_URI', RATE_LIMIT_STORAGE_URI)
+    JOB_STATUS_TTL = int(os.getenv('JOB_STATUS_TTL', 86400))
+    # Concurrent Z-API sends per bulk job; send starts are still spaced by the job's interval
+    BULK_SEND_WORKERS = int(os.getenv('BULK_SEND_WORKERS', 8))
+    # Scheduler threads; a group schedule or queued bulk send holds one for its whole paced run
+    SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', 20))
     
     # AI Integration (Optional)
     OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
@@ -49,4 +74,11 @@ class Config:
                 "Z-API credentials not configured. "
                 "Please set ZAPI_INSTANCE_ID and ZAPI_INSTANCE_TOKEN in .env file."
             )
-        return True
\ No newline at end of file
+        return True
+
+
+@lru_cache(maxsize=1)
+def get_config():
+    """Return the validated configuration, validating only once per process."""
+    Config.validate()
+    return Config
@@ -1,8 +1,70 @@
-﻿from datetime import datetime
+﻿import re
+from datetime import datetime, timezone
+from operator import attrgetter
 from flask_sqlalchemy import SQLAlchemy
+from loguru import logger
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import validates
+from sqlalchemy.sql.functions import FunctionElement
 
 db = SQLAlchemy()
 
+UTC = timezone.utc
+
+def utcnow():
+    """Current UTC time as a naive datetime, matching the naive DateTime columns."""
+    return datetime.now(UTC).replace(tzinfo=None)
+
+class sql_utcnow(FunctionElement):
+    """Database-side UTC timestamp, rendered per dialect.
+
+    On SQLite it is formatted like SQLAlchemy's own datetime binds so that
+    server-generated and Python-bound values compare correctly as strings.
+    """
+    type = db.DateTime()
+    inherit_cache = True
+
+@compiles(sql_utcnow)
+def _sql_utcnow_default(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+@compiles(sql_utcnow, 'sqlite')
+def _sql_utcnow_sqlite(element, compiler, **kw):
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+@compiles(sql_utcnow, 'postgresql')
+def _sql_utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+# Pre-bound attribute getters used by to_dict (one call instead of N attribute lookups)
+_GROUP_FIELDS = attrgetter('id', 'name', 'description', 'created_at')
+_CONTACT_FIELDS = attrgetter('id', 'name', 'whatsapp_number', 'group_id', 'group', 'created_at')
+_MESSAGE_FIELDS = attrgetter(
+    'id', 'contact_id', 'contact', 'phone_number', 'content', 'status',
+    'provider', 'provider_message_id', 'error', 'created_at'
+)
+_SCHEDULE_FIELDS = attrgetter(
+    'id', 'job_id', 'type', 'schedule_type', 'contact_id', 'phone_number', 'group_id',
+    'message', 'run_at', 'cron_expression', 'status', 'last_run_at', 'created_at', 'updated_at'
+)
+
+# Digits-only E.164 (optional leading +), compiled once for every write path
+_PHONE_RE = re.compile(r'^\+?[1-9]\d{7,14}$')
+
+def _iso(obj, key, value):
+    """Return value.isoformat(), reusing the string cached on obj while value is unchanged."""
+    if not value:
+        return None
+    cache = obj.__dict__.setdefault('_iso_cache', {})
+    hit = cache.get(key)
+    if hit is not None and hit[0] is value:
+        return hit[1]
+    iso = value.isoformat()
+    cache[key] = (value, iso)
+    return iso
+
 class Group(db.Model):
     """Model for contact groups."""
     __tablename__ = 'groups'
@@ -10,52 +72,187 @@ class Group(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    created_at = db.Column(db.DateTime, default=sql_utcnow(), server_default=sql_utcnow(), index=True)
     
     # Relationships
-    contacts = db.relationship('Contact', backref='group', lazy='dynamic', cascade='all, delete-orphan')
+    contacts = db.relationship('Contact', backref=db.backref('group', lazy='joined'), lazy='select', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Group {self.name}>'
     
-    def to_dict(self):
+    @classmethod
+    def with_counts(cls):
+        """Return (group, contact_count) pairs using a single aggregate query."""
+        return (
+            db.session.query(cls, db.func.count(Contact.id))
+            .outerjoin(Contact, Contact.group_id == cls.id)
+            .group_by(cls.id)
+            .order_by(cls.id)
+            .all()
+        )
+    
+    @classmethod
+    def delete_by_id(cls, group_id):
+        """Delete a group and its contacts with bulk statements; returns the deleted group rowcount.
+
+        Mirrors the ORM cascades (contacts and their messages go, schedules are detached)
+        without loading the rows first. The caller commits.
+        """
+        contact_ids = db.select(Contact.id).where(Contact.group_id == group_id).scalar_subquery()
+        db.session.execute(db.delete(Message).where(Message.contact_id.in_(contact_ids)))
+        db.session.execute(
+            db.update(ScheduledMessage)
+            .where(db.or_(ScheduledMessage.group_id == group_id, ScheduledMessage.contact_id.in_(contact_ids)))
+            .values(group_id=db.case((ScheduledMessage.group_id == group_id, None), else_=ScheduledMessage.group_id),
+                    contact_id=db.case((ScheduledMessage.contact_id.in_(contact_ids), None), else_=ScheduledMessage.contact_id))
+        )
+        db.session.execute(db.delete(Contact).where(Contact.group_id == group_id))
+        return db.session.execute(db.delete(cls).where(cls.id == group_id)).rowcount
+    
+    @property
+    def contact_count(self):
+        """Count contacts with a COUNT(*) query, without loading the collection."""
+        return (
+            db.session.query(db.func.count(Contact.id))
+            .filter(Contact.group_id == self.id)
+            .scalar()
+        )
+    
+    def to_dict(self, contact_count=None):
+        if contact_count is None:
+            contact_count = self.contact_count
+        id, name, description, created_at = _GROUP_FIELDS(self)
         return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'contact_count': self.contacts.count()
+            'id': id,
+            'name': name,
+            'description': description,
+            'created_at': _iso(self, 'created_at', created_at),
+            'contact_count': contact_count
         }
 
 class Contact(db.Model):
     """Model for contacts."""
     __tablename__ = 'contacts'
+    PHONE_RE = _PHONE_RE
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     whatsapp_number = db.Column(db.String(20), unique=True, nullable=False, index=True)
     group_id = db.Column(db.Integer, db.ForeignKey('groups.id'), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    created_at = db.Column(db.DateTime, default=sql_utcnow(), server_default=sql_utcnow(), index=True)
     
     # Relationships
-    messages = db.relationship('Message', backref='contact', lazy='dynamic', cascade='all, delete-orphan')
+    messages = db.relationship('Message', backref=db.backref('contact', lazy='joined'), lazy='select', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Contact {self.name} ({self.whatsapp_number})>'
     
+    @validates('whatsapp_number')
+    def _validate_whatsapp_number(self, key, value):
+        if not value or not _PHONE_RE.match(value):
+            raise ValueError(f'Invalid WhatsApp number format: {value}')
+        return value
+    
+    @classmethod
+    def search_clause(cls, search):
+        """Substring match on name/number that can use the dialect's search index."""
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            # ILIKE is accelerated by the pg_trgm GIN indexes
+            pattern = f'%{search}%'
+            return db.or_(cls.name.ilike(pattern), cls.whatsapp_number.ilike(pattern))
+        if dialect == 'sqlite' and _search_index['sqlite_fts'] and len(search) >= 3:
+            # Trigram FTS5 matches substrings of 3+ characters; quote as a phrase
+            phrase = '"' + search.replace('"', '""') + '"'
+            matches = db.text(
+                "SELECT rowid FROM contacts_fts WHERE contacts_fts MATCH :phrase"
+            ).bindparams(phrase=phrase).columns(rowid=db.Integer)
+            return cls.id.in_(matches)
+        return db.or_(cls.name.contains(search), cls.whatsapp_number.contains(search))
+    
+    @classmethod
+    def upsert(cls, name, whatsapp_number, group_id):
+        """Insert or update a contact by number in one statement; returns the row.
+
+        An existing contact keeps its group and only takes ``group_id`` if it had none.
+        The caller commits.
+        """
+        dialect = db.session.get_bind().dialect.name
+        insert = {'postgresql': pg_insert, 'sqlite': sqlite_insert}.get(dialect)
+        if insert is None:
+            contact = cls.query.filter_by(whatsapp_number=whatsapp_number).first()
+            if contact:
+                contact.name = name
+                if contact.group_id is None:
+                    contact.group_id = group_id
+            else:
+                contact = cls(name=name, whatsapp_number=whatsapp_number, group_id=group_id)
+                db.session.add(contact)
+            return contact
+        if not _PHONE_RE.match(whatsapp_number or ''):
+            raise ValueError(f'Invalid WhatsApp number format: {whatsapp_number}')
+        stmt = insert(cls).values(name=name, whatsapp_number=whatsapp_number, group_id=group_id)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.whatsapp_number],
+            set_={'name': stmt.excluded.name, 'group_id': db.func.coalesce(cls.group_id, stmt.excluded.group_id)},
+        ).returning(cls)
+        return db.session.scalars(stmt, execution_options={'populate_existing': True}).one()
+    
+    @classmethod
+    def list_select(cls):
+        """Core SELECT of the to_dict() columns, for list views that skip ORM hydration."""
+        return (
+            db.select(cls.id, cls.name, cls.whatsapp_number, cls.group_id,
+                      Group.name.label('group_name'), cls.created_at)
+            .outerjoin(Group, cls.group_id == Group.id)
+        )
+    
+    @staticmethod
+    def row_dict(row):
+        """to_dict() shape for a row from list_select()."""
+        id, name, whatsapp_number, group_id, group_name, created_at = row
+        return {
+            'id': id,
+            'name': name,
+            'whatsapp_number': whatsapp_number,
+            'group_id': group_id,
+            'group_name': group_name,
+            'created_at': created_at.isoformat() if created_at else None
+        }
+    
+    @classmethod
+    def delete_by_id(cls, contact_id):
+        """Delete a contact with bulk statements; returns the deleted rowcount.
+
+        Mirrors the ORM cascades (messages go, schedules are detached) without loading
+        the rows first. The caller commits.
+        """
+        db.session.execute(db.delete(Message).where(Message.contact_id == contact_id))
+        db.session.execute(
+            db.update(ScheduledMessage).where(ScheduledMessage.contact_id == contact_id).values(contact_id=None)
+        )
+        return db.session.execute(db.delete(cls).where(cls.id == contact_id)).rowcount
+    
     def to_dict(self):
+        id, name, whatsapp_number, group_id, group, created_at = _CONTACT_FIELDS(self)
         return {
-            'id': self.id,
-            'name': self.name,
-            'whatsapp_number': self.whatsapp_number,
-            'group_id': self.group_id,
-            'group_name': self.group.name if self.group else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'id': id,
+            'name': name,
+            'whatsapp_number': whatsapp_number,
+            'group_id': group_id,
+            'group_name': group.name if group else None,
+            'created_at': _iso(self, 'created_at', created_at)
         }
 
 class Message(db.Model):
     """Model for sent messages."""
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Per-contact history view: WHERE contact_id = ? ORDER BY created_at DESC
+        db.Index('ix_messages_contact_id_created_at', 'contact_id', db.text('created_at DESC')),
+        # Keyset pagination: ORDER BY created_at DESC, id DESC
+        db.Index('ix_messages_created_id', db.text('created_at DESC'), db.text('id DESC')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'), nullable=True)
@@ -65,29 +262,72 @@ class Message(db.Model):
     provider = db.Column(db.String(50), default='z-api')
     provider_message_id = db.Column(db.String(100))
     error = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    created_at = db.Column(db.DateTime, default=sql_utcnow(), server_default=sql_utcnow(), index=True)
     
     def __repr__(self):
         contact_info = f"Contact {self.contact_id}" if self.contact_id else self.phone_number
         return f'<Message to {contact_info} - {self.status}>'
     
+    @classmethod
+    def bulk_record(cls, records):
+        """Insert many message rows (plain dicts) in a single executemany and commit."""
+        if not records:
+            return
+        db.session.bulk_insert_mappings(cls, records)
+        db.session.commit()
+    
+    @classmethod
+    def list_select(cls):
+        """Core SELECT of the to_dict() columns, for list views that skip ORM hydration."""
+        return (
+            db.select(cls.id, cls.contact_id, Contact.name.label('contact_name'),
+                      Contact.whatsapp_number.label('contact_number'), cls.phone_number,
+                      cls.content, cls.status, cls.provider, cls.provider_message_id,
+                      cls.error, cls.created_at)
+            .outerjoin(Contact, cls.contact_id == Contact.id)
+        )
+    
+    @staticmethod
+    def row_dict(row):
+        """to_dict() shape for a row from list_select()."""
+        (id, contact_id, contact_name, contact_number, phone_number, content, status,
+         provider, provider_message_id, error, created_at) = row
+        return {
+            'id': id,
+            'contact_id': contact_id,
+            'contact_name': contact_name,
+            'phone_number': phone_number or contact_number,
+            'content': content,
+            'status': status,
+            'provider': provider,
+            'provider_message_id': provider_message_id,
+            'error': error,
+            'created_at': created_at.isoformat() if created_at else None
+        }
+    
     def to_dict(self):
+        (id, contact_id, contact, phone_number, content, status,
+         provider, provider_message_id, error, created_at) = _MESSAGE_FIELDS(self)
         return {
-            'id': self.id,
-            'contact_id': self.contact_id,
-            'contact_name': self.contact.name if self.contact else None,
-            'phone_number': self.phone_number or (self.contact.whatsapp_number if self.contact else None),
-            'content': self.content,
-            'status': self.status,
-            'provider': self.provider,
-            'provider_message_id': self.provider_message_id,
-            'error': self.error,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'id': id,
+            'contact_id': contact_id,
+            'contact_name': contact.name if contact else None,
+            'phone_number': phone_number or (contact.whatsapp_number if contact else None),
+            'content': content,
+            'status': status,
+            'provider': provider,
+            'provider_message_id': provider_message_id,
+            'error': error,
+            'created_at': _iso(self, 'created_at', created_at)
         }
 
 class ScheduledMessage(db.Model):
     """Model for scheduled messages (one-time or cron)."""
     __tablename__ = 'scheduled_messages'
+    __table_args__ = (
+        db.Index('ix_sched_status_run_at', 'status', 'run_at'),
+        db.Index('ix_sched_status_created_at', 'status', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     job_id = db.Column(db.String(64), unique=True, index=True)
@@ -100,8 +340,8 @@ class ScheduledMessage(db.Model):
     group_id = db.Column(db.Integer, db.ForeignKey('groups.id'), nullable=True)
     
     # Relationships
-    contact = db.relationship('Contact', backref='scheduled_messages')
-    group = db.relationship('Group', backref='scheduled_messages')
+    contact = db.relationship('Contact', backref='scheduled_messages', lazy='joined')
+    group = db.relationship('Group', backref='scheduled_messages', lazy='joined')
 
     # Content
     message = db.Column(db.Text, nullable=False)
@@ -111,30 +351,32 @@ class ScheduledMessage(db.Model):
     cron_expression = db.Column(db.String(100), nullable=True)  # for cron
 
     # Status
-    status = db.Column(db.String(20), default='scheduled', index=True)  # scheduled, running, completed, canceled, failed
+    status = db.Column(db.String(20), default='scheduled')  # scheduled, running, completed, canceled, failed
     last_run_at = db.Column(db.DateTime, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=sql_utcnow(), server_default=sql_utcnow(), index=True)
+    updated_at = db.Column(db.DateTime, default=sql_utcnow(), server_default=sql_utcnow(), onupdate=sql_utcnow())
 
     def __repr__(self):
         return f'<ScheduledMessage {self.id} {self.schedule_type} {self.status}>'
 
     def to_dict(self):
+        (id, job_id, type, schedule_type, contact_id, phone_number, group_id, message,
+         run_at, cron_expression, status, last_run_at, created_at, updated_at) = _SCHEDULE_FIELDS(self)
         return {
-            'id': self.id,
-            'job_id': self.job_id,
-            'type': self.type,
-            'schedule_type': self.schedule_type,
-            'contact_id': self.contact_id,
-            'phone_number': self.phone_number,
-            'group_id': self.group_id,
-            'message': self.message,
-            'run_at': self.run_at.isoformat() if self.run_at else None,
-            'cron_expression': self.cron_expression,
-            'status': self.status,
-            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'id': id,
+            'job_id': job_id,
+            'type': type,
+            'schedule_type': schedule_type,
+            'contact_id': contact_id,
+            'phone_number': phone_number,
+            'group_id': group_id,
+            'message': message,
+            'run_at': _iso(self, 'run_at', run_at),
+            'cron_expression': cron_expression,
+            'status': status,
+            'last_run_at': _iso(self, 'last_run_at', last_run_at),
+            'created_at': _iso(self, 'created_at', created_at),
+            'updated_at': _iso(self, 'updated_at', updated_at)
         }
 
 class Setting(db.Model):
@@ -144,11 +386,83 @@ class Setting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String(100), unique=True, nullable=False, index=True)
     value = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=sql_utcnow(), server_default=sql_utcnow())
+    updated_at = db.Column(db.DateTime, default=sql_utcnow(), server_default=sql_utcnow(), onupdate=sql_utcnow())
 
     def __repr__(self):
         return f'<Setting {self.key}>'
 
+    @classmethod
+    def upsert_many(cls, data):
+        """Insert or update settings by key in one statement. The caller commits."""
+        if not data:
+            return
+        dialect = db.session.get_bind().dialect.name
+        insert = {'postgresql': pg_insert, 'sqlite': sqlite_insert}.get(dialect)
+        if insert is None:
+            for k, v in data.items():
+                s = cls.query.filter_by(key=k).first()
+                if s:
+                    s.value = v
+                else:
+                    db.session.add(cls(key=k, value=v))
+            return
+        stmt = insert(cls).values([{'key': k, 'value': v} for k, v in data.items()])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.key],
+            # onupdate defaults don't apply to ON CONFLICT, so stamp updated_at here
+            set_={'value': stmt.excluded.value, 'updated_at': sql_utcnow()},
+        )
+        db.session.execute(stmt)
+
     def to_dict(self):
         return {'key': self.key, 'value': self.value}
+
+
+# ----- Contact search indexes -----
+_search_index = {'sqlite_fts': False}
+
+_SQLITE_CONTACTS_FTS = (
+    "CREATE VIRTUAL TABLE contacts_fts USING fts5("
+    "name, whatsapp_number, content='contacts', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER contacts_fts_ai AFTER INSERT ON contacts BEGIN "
+    "INSERT INTO contacts_fts(rowid, name, whatsapp_number) "
+    "VALUES (new.id, new.name, new.whatsapp_number); END",
+    "CREATE TRIGGER contacts_fts_ad AFTER DELETE ON contacts BEGIN "
+    "INSERT INTO contacts_fts(contacts_fts, rowid, name, whatsapp_number) "
+    "VALUES ('delete', old.id, old.name, old.whatsapp_number); END",
+    "CREATE TRIGGER contacts_fts_au AFTER UPDATE ON contacts BEGIN "
+    "INSERT INTO contacts_fts(contacts_fts, rowid, name, whatsapp_number) "
+    "VALUES ('delete', old.id, old.name, old.whatsapp_number); "
+    "INSERT INTO contacts_fts(rowid, name, whatsapp_number) "
+    "VALUES (new.id, new.name, new.whatsapp_number); END",
+    "INSERT INTO contacts_fts(contacts_fts) VALUES ('rebuild')",
+)
+
+_POSTGRES_CONTACTS_TRGM = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_contacts_name_trgm ON contacts USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_contacts_whatsapp_number_trgm ON contacts USING gin (whatsapp_number gin_trgm_ops)",
+)
+
+def init_search_indexes(engine):
+    """Create contact search indexes for the engine's dialect (idempotent).
+
+    Falls back to plain LIKE search when the dialect has no supported index or
+    the extension is unavailable.
+    """
+    try:
+        with engine.begin() as conn:
+            if engine.dialect.name == 'postgresql':
+                for stmt in _POSTGRES_CONTACTS_TRGM:
+                    conn.exec_driver_sql(stmt)
+            elif engine.dialect.name == 'sqlite':
+                exists = conn.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='contacts_fts'"
+                ).first()
+                if not exists:
+                    for stmt in _SQLITE_CONTACTS_FTS:
+                        conn.exec_driver_sql(stmt)
+                _search_index['sqlite_fts'] = True
+    except Exception:
+        logger.warning("Contact search index unavailable; falling back to LIKE search")
@@ -1,21 +1,38 @@
-from flask import Blueprint, render_template, request, jsonify, current_app, url_for, abort
-from datetime import datetime, timedelta
+from flask import Blueprint, render_template, request, jsonify, current_app, url_for, abort, stream_with_context
+from datetime import datetime, time, timedelta
 from marshmallow import ValidationError
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import REGCLASS
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from loguru import logger
-from models import db, Contact, Group, Message, ScheduledMessage
+from models import db, Contact, Group, Message, ScheduledMessage, utcnow
 from utils.validators import ContactSchema, MessageSchema, BulkMessageSchema, ScheduleSchema
 from utils.phone import normalize_to_e164
 from services.messaging import get_messaging_service
-from services.ai import get_ai_service
 from services.scheduler import schedule_message_once, schedule_message_cron, list_schedules, cancel_schedule, pause_schedule, resume_schedule, update_schedule
 from services.settings_service import get_settings as get_app_settings, set_settings as save_app_settings, ZAPI_KEYS
 from config import Config
-from functools import wraps
+import hashlib
+import orjson
+from functools import lru_cache, wraps
+from threading import Lock
+from cachetools import TTLCache, cached
 from itsdangerous import URLSafeSerializer, BadSignature
 
 main_bp = Blueprint('main', __name__)
 
+_MIDNIGHT = time(0, 0)
+
+# Schemas are stateless once built; construct them once rather than per request
+_CONTACT_SCHEMA = ContactSchema()
+_CONTACT_PATCH_SCHEMA = ContactSchema(partial=True)
+_MESSAGE_SCHEMA = MessageSchema()
+_BULK_MESSAGE_SCHEMA = BulkMessageSchema()
+_SCHEDULE_SCHEMA = ScheduleSchema()
+
 # ----- Public contact form (invite link) helpers -----
+@lru_cache(maxsize=1)
 def _invite_serializer():
     return URLSafeSerializer(Config.SECRET_KEY, salt='group-invite')
 
@@ -32,22 +49,111 @@ def verify_group_token(token: str) -> int:
     except (BadSignature, Exception):
         abort(404)
 
+def _is_unique_violation(error: IntegrityError, column) -> bool:
+    """True when error is a unique-constraint violation on the given table column."""
+    orig = error.orig
+    text = str(orig)
+    code = getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)
+    if code is not None:
+        # PostgreSQL: unique_violation, naming the column's constraint or key
+        constraint = getattr(getattr(orig, 'diag', None), 'constraint_name', None) or ''
+        return code == '23505' and (column.name in constraint or f'({column.name})' in text)
+    return f'UNIQUE constraint failed: {column.table.name}.{column.name}' in text
+
+def _conditional(view):
+    """Tag 200 responses with a content ETag and answer 304 when the client already has it."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        tag = hashlib.blake2b(response.get_data(), digest_size=16).hexdigest()
+        # Flask-Compress appends ":<encoding>" to the tag of compressed bodies
+        for held in request.if_none_match.as_set():
+            if held == tag or held.startswith(tag + ':'):
+                not_modified = current_app.response_class(status=304)
+                not_modified.set_etag(held)
+                return not_modified
+        response.set_etag(tag)
+        return response
+    return wrapper
+
+
+# Pages larger than this are streamed row by row instead of built in memory
+_STREAM_PAGE_SIZE = 200
+
+def _per_page_arg(default=20):
+    """?per_page= as a positive int; missing, invalid or < 1 falls back to default, as paginate() did."""
+    per_page = request.args.get('per_page', default, type=int)
+    return per_page if per_page >= 1 else default
+
+def _offset_page(stmt, page, per_page, row_dict):
+    """Offset page plus total in one query via COUNT(*) OVER (); returns (items, total, pages)."""
+    page, per_page = max(page, 1), max(per_page, 1)
+    rows = db.session.execute(
+        stmt.add_columns(db.func.count().over().label('total'))
+        .offset((page - 1) * per_page).limit(per_page)
+    ).all()
+    if rows:
+        total = rows[0].total
+    else:
+        # Past the last page there is no row to carry the window total
+        total = db.session.execute(db.select(db.func.count()).select_from(stmt.subquery())).scalar()
+    return [row_dict(row[:-1]) for row in rows], total, -(-total // per_page)
+
+def _keyset_slice(stmt, per_page):
+    """Fetch one row past the page to learn whether a next page exists."""
+    rows = db.session.execute(stmt.limit(per_page + 1)).all()
+    return rows[:per_page], len(rows) > per_page
+
+
+_PG_CLASS = db.table('pg_class', db.column('oid'), db.column('reltuples'))
+
+def _table_total(model):
+    """Row-count expression for a whole table: the planner estimate on PostgreSQL, COUNT(*) elsewhere."""
+    exact = db.select(db.func.count()).select_from(model).scalar_subquery()
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return exact
+    # reltuples is -1 until the table has been vacuumed/analyzed once
+    estimate = (
+        db.select(db.cast(_PG_CLASS.c.reltuples, db.BigInteger))
+        .where(_PG_CLASS.c.oid == db.cast(db.literal(model.__tablename__), REGCLASS))
+        .scalar_subquery()
+    )
+    return db.case((estimate >= 0, estimate), else_=exact)
+
+
+@cached(TTLCache(maxsize=4, ttl=30), lock=Lock())
+def _dashboard_counts(today_start):
+    """Return (contacts, groups, messages since today_start) in one round-trip, cached briefly."""
+    count = db.func.count
+    return tuple(db.session.execute(
+        db.select(
+            _table_total(Contact),
+            _table_total(Group),
+            db.select(count()).select_from(Message)
+            .where(Message.created_at >= today_start).scalar_subquery(),
+        )
+    ).one())
+
 
 # Web Pages
 @main_bp.route('/')
 def dashboard():
     """Dashboard with metrics."""
-    # Get metrics
-    total_contacts = Contact.query.count()
-    total_groups = Group.query.count()
-    
-    # Messages sent today
-    today = datetime.utcnow().date()
-    today_start = datetime.combine(today, datetime.min.time())
-    messages_today = Message.query.filter(Message.created_at >= today_start).count()
+    # Get metrics (messages counted since the start of today)
+    today = utcnow().date()
+    today_start = datetime.combine(today, _MIDNIGHT)
+    total_contacts, total_groups, messages_today = _dashboard_counts(today_start)
     
-    # Recent messages
-    recent_messages = Message.query.order_by(Message.created_at.desc()).limit(10).all()
+    # Recent messages: plain rows carrying only what the table renders
+    recent_messages = db.session.execute(
+        db.select(Message.created_at, Contact.name.label('contact_name'),
+                  Message.phone_number, Message.content, Message.status)
+        .outerjoin(Contact, Message.contact_id == Contact.id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(10)
+    ).all()
     
     return render_template('dashboard.html',
                          total_contacts=total_contacts,
@@ -89,30 +195,38 @@ def settings_page():
 
 # Contacts API
 @main_bp.route('/api/contacts', methods=['GET'])
+@_conditional
 def get_contacts():
-    """Get all contacts."""
+    """Get contacts, keyset-paginated by id (pass ?page= for offset pagination)."""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        page = request.args.get('page', type=int)
+        per_page = _per_page_arg()
+        after_id = request.args.get('after_id', type=int)
         search = request.args.get('search', '')
         
-        query = Contact.query
-        if search:
-            query = query.filter(
-                db.or_(
-                    Contact.name.contains(search),
-                    Contact.whatsapp_number.contains(search)
-                )
-            )
+        filters = [Contact.search_clause(search)] if search else []
         
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        if page is not None:
+            stmt = Contact.list_select().where(*filters).order_by(Contact.id)
+            contacts, total, pages = _offset_page(stmt, page, per_page, Contact.row_dict)
+            
+            return jsonify({
+                'success': True,
+                'contacts': contacts,
+                'total': total,
+                'pages': pages,
+                'current_page': page
+            })
+        
+        if after_id:
+            filters.append(Contact.id > after_id)
+        stmt = Contact.list_select().where(*filters).order_by(Contact.id)
+        contacts, has_more = _keyset_slice(stmt, per_page)
         
         return jsonify({
             'success': True,
-            'contacts': [c.to_dict() for c in pagination.items],
-            'total': pagination.total,
-            'pages': pagination.pages,
-            'current_page': page
+            'contacts': [Contact.row_dict(c) for c in contacts],
+            'next_cursor': {'after_id': contacts[-1].id} if has_more else None
         })
     except Exception as e:
         logger.exception("Error fetching contacts")
@@ -122,13 +236,7 @@ def get_contacts():
 def create_contact():
     """Create a new contact."""
     try:
-        schema = ContactSchema()
-        data = schema.load(request.json)
-        
-        # Check if number already exists
-        existing = Contact.query.filter_by(whatsapp_number=data['whatsapp_number']).first()
-        if existing:
-            return jsonify({'success': False, 'error': 'Contact with this number already exists'}), 400
+        data = _CONTACT_SCHEMA.load(request.json)
         
         contact = Contact(
             name=data['name'],
@@ -143,6 +251,13 @@ def create_contact():
         
     except ValidationError as e:
         return jsonify({'success': False, 'errors': e.messages}), 400
+    except IntegrityError as e:
+        db.session.rollback()
+        if _is_unique_violation(e, Contact.__table__.c.whatsapp_number):
+            return jsonify({'success': False, 'error': 'Contact with this number already exists'}), 400
+        # Anything else (e.g. a foreign key on PostgreSQL) is reported as-is
+        logger.exception("Error creating contact")
+        return jsonify({'success': False, 'error': str(e)}), 500
     except Exception as e:
         logger.exception("Error creating contact")
         db.session.rollback()
@@ -152,21 +267,15 @@ def create_contact():
 def update_contact(contact_id):
     """Update a contact."""
     try:
-        contact = Contact.query.get_or_404(contact_id)
+        contact = db.session.get(Contact, contact_id)
+        if contact is None:
+            return jsonify({'success': False, 'error': 'Contact not found'}), 404
         
-        schema = ContactSchema(partial=True)
-        data = schema.load(request.json)
+        data = _CONTACT_PATCH_SCHEMA.load(request.json)
         
         if 'name' in data:
             contact.name = data['name']
         if 'whatsapp_number' in data:
-            # Check if new number already exists
-            existing = Contact.query.filter(
-                Contact.whatsapp_number == data['whatsapp_number'],
-                Contact.id != contact_id
-            ).first()
-            if existing:
-                return jsonify({'success': False, 'error': 'Another contact with this number already exists'}), 400
             contact.whatsapp_number = data['whatsapp_number']
         if 'group_id' in data:
             contact.group_id = data['group_id']
@@ -177,6 +286,13 @@ def update_contact(contact_id):
         
     except ValidationError as e:
         return jsonify({'success': False, 'errors': e.messages}), 400
+    except IntegrityError as e:
+        db.session.rollback()
+        if _is_unique_violation(e, Contact.__table__.c.whatsapp_number):
+            return jsonify({'success': False, 'error': 'Another contact with this number already exists'}), 400
+        # Anything else (e.g. a foreign key on PostgreSQL) is reported as-is
+        logger.exception("Error updating contact")
+        return jsonify({'success': False, 'error': str(e)}), 500
     except Exception as e:
         logger.exception("Error updating contact")
         db.session.rollback()
@@ -186,9 +302,10 @@ def update_contact(contact_id):
 def delete_contact(contact_id):
     """Delete a contact."""
     try:
-        contact = Contact.query.get_or_404(contact_id)
-        db.session.delete(contact)
+        deleted = Contact.delete_by_id(contact_id)
         db.session.commit()
+        if not deleted:
+            return jsonify({'success': False, 'error': 'Contact not found'}), 404
         
         return jsonify({'success': True, 'message': 'Contact deleted successfully'})
         
@@ -199,13 +316,14 @@ def delete_contact(contact_id):
 
 # Groups API
 @main_bp.route('/api/groups', methods=['GET'])
+@_conditional
 def get_groups():
     """Get all groups."""
     try:
-        groups = Group.query.all()
+        groups = Group.with_counts()
         return jsonify({
             'success': True,
-            'groups': [g.to_dict() for g in groups]
+            'groups': [g.to_dict(contact_count=count) for g, count in groups]
         })
     except Exception as e:
         logger.exception("Error fetching groups")
@@ -220,11 +338,6 @@ def create_group():
         if not data.get('name'):
             return jsonify({'success': False, 'error': 'Group name is required'}), 400
         
-        # Check if group name already exists
-        existing = Group.query.filter_by(name=data['name']).first()
-        if existing:
-            return jsonify({'success': False, 'error': 'Group with this name already exists'}), 400
-        
         group = Group(
             name=data['name'],
             description=data.get('description', '')
@@ -235,6 +348,13 @@ def create_group():
         
         return jsonify({'success': True, 'group': group.to_dict()}), 201
         
+    except IntegrityError as e:
+        db.session.rollback()
+        if _is_unique_violation(e, Group.__table__.c.name):
+            return jsonify({'success': False, 'error': 'Group with this name already exists'}), 400
+        # Anything else (e.g. a foreign key on PostgreSQL) is reported as-is
+        logger.exception("Error creating group")
+        return jsonify({'success': False, 'error': str(e)}), 500
     except Exception as e:
         logger.exception("Error creating group")
         db.session.rollback()
@@ -244,9 +364,10 @@ def create_group():
 def delete_group(group_id):
     """Delete a group."""
     try:
-        group = Group.query.get_or_404(group_id)
-        db.session.delete(group)
+        deleted = Group.delete_by_id(group_id)
         db.session.commit()
+        if not deleted:
+            return jsonify({'success': False, 'error': 'Group not found'}), 404
         
         return jsonify({'success': True, 'message': 'Group deleted successfully'})
         
@@ -260,8 +381,7 @@ def delete_group(group_id):
 def send_message():
     """Send a single message."""
     try:
-        schema = MessageSchema()
-        data = schema.load(request.json)
+        data = _MESSAGE_SCHEMA.load(request.json)
         
         messaging = get_messaging_service()
         
@@ -286,8 +406,7 @@ def send_message():
 def send_bulk_message():
     """Send messages to all contacts in a group."""
     try:
-        schema = BulkMessageSchema()
-        data = schema.load(request.json)
+        data = _BULK_MESSAGE_SCHEMA.load(request.json)
         
         messaging = get_messaging_service()
         
@@ -336,13 +455,16 @@ def compose_with_ai():
         if not data.get('topic'):
             return jsonify({'success': False, 'error': 'Topic is required'}), 400
         
+        # httpx/h2 are slow to import; only pay for them once AI is actually used
+        from services.ai import get_ai_service
         ai_service = get_ai_service()
         
         result = ai_service.compose_message(
             topic=data['topic'],
             tone=data.get('tone', 'friendly'),
             placeholders=data.get('placeholders'),
-            provider=data.get('provider', 'openrouter')
+            provider=data.get('provider', 'openrouter'),
+            regenerate=bool(data.get('regenerate'))
         )
         
         if result['success']:
@@ -359,8 +481,7 @@ def compose_with_ai():
 def schedule_message():
     """Schedule a message (individual or group) for later or recurring via cron."""
     try:
-        schema = ScheduleSchema()
-        data = schema.load(request.json)
+        data = _SCHEDULE_SCHEMA.load(request.json)
 
         t = data['type']
         st = data['schedule_type']
@@ -416,10 +537,24 @@ def schedule_message():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @main_bp.route('/api/schedules', methods=['GET'])
+@_conditional
 def get_schedules():
-    """List all schedules with target details."""
+    """List schedules with target details, newest first.
+
+    Optional ``limit``/``offset`` query args page through long histories; without
+    them every schedule is returned.
+    """
     try:
-        schedules = ScheduledMessage.query.order_by(ScheduledMessage.created_at.desc()).all()
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', 0, type=int)
+        query = (
+            ScheduledMessage.query
+            .options(joinedload(ScheduledMessage.contact), joinedload(ScheduledMessage.group))
+            .order_by(ScheduledMessage.created_at.desc(), ScheduledMessage.id.desc())
+        )
+        if limit is not None:
+            query = query.limit(max(limit, 1)).offset(max(offset, 0))
+        schedules = query.all()
         out = []
         for s in schedules:
             d = s.to_dict()
@@ -508,13 +643,26 @@ def get_group_invite_link(group_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# Dashboard polling caches; both are dropped when settings are saved
+_overview_cache = TTLCache(maxsize=1, ttl=15)
+_settings_cache = TTLCache(maxsize=1, ttl=30)
+_polling_cache_lock = Lock()
+
+@cached(_overview_cache, lock=_polling_cache_lock)
+def _zapi_overview():
+    from services.zapi_client import get_client
+    return get_client().get_overview()
+
+@cached(_settings_cache, lock=_polling_cache_lock)
+def _zapi_settings():
+    return get_app_settings(ZAPI_KEYS)
+
 # Z-API Overview for dashboard
 @main_bp.route('/api/zapi/overview', methods=['GET'])
+@_conditional
 def zapi_overview():
     try:
-        from services.zapi_client import get_client
-        client = get_client()
-        data = client.get_overview()
+        data = _zapi_overview()
         return jsonify({'success': True, 'overview': data})
     except Exception as e:
         logger.exception('Error fetching Z-API overview')
@@ -523,9 +671,10 @@ def zapi_overview():
 
 # Settings API
 @main_bp.route('/api/settings', methods=['GET'])
+@_conditional
 def get_settings_api():
     try:
-        data = get_app_settings(ZAPI_KEYS)
+        data = _zapi_settings()
         return jsonify({'success': True, 'settings': data})
     except Exception as e:
         logger.exception('Error fetching settings')
@@ -540,6 +689,9 @@ def save_settings_api():
         if not to_save:
             return jsonify({'success': False, 'error': 'No valid settings provided'}), 400
         save_app_settings(to_save)
+        with _polling_cache_lock:
+            _settings_cache.clear()
+            _overview_cache.clear()
         return jsonify({'success': True})
     except Exception as e:
         logger.exception('Error saving settings')
@@ -548,37 +700,82 @@ def save_settings_api():
 
 # Message History API
 @main_bp.route('/api/messages', methods=['GET'])
+@_conditional
 def get_messages():
-    """Get message history."""
+    """Get message history, keyset-paginated by (created_at, id) (pass ?page= for offset pagination)."""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        page = request.args.get('page', type=int)
+        per_page = _per_page_arg()
         status = request.args.get('status')
         contact_id = request.args.get('contact_id', type=int)
+        after_id = request.args.get('after_id', type=int)
+        after_created_at = request.args.get('after_created_at')
         
-        query = Message.query
-        
+        filters = []
         if status:
-            query = query.filter_by(status=status)
+            filters.append(Message.status == status)
         if contact_id:
-            query = query.filter_by(contact_id=contact_id)
+            filters.append(Message.contact_id == contact_id)
+        order = (Message.created_at.desc(), Message.id.desc())
         
-        query = query.order_by(Message.created_at.desc())
+        if page is not None:
+            stmt = Message.list_select().where(*filters).order_by(*order)
+            messages, total, pages = _offset_page(stmt, page, per_page, Message.row_dict)
+            
+            return jsonify({
+                'success': True,
+                'messages': messages,
+                'total': total,
+                'pages': pages,
+                'current_page': page
+            })
+        
+        if after_id and after_created_at:
+            try:
+                cursor_created_at = datetime.fromisoformat(after_created_at)
+            except ValueError:
+                return jsonify({'success': False, 'error': 'Invalid after_created_at format. Use ISO datetime'}), 400
+            filters.append(tuple_(Message.created_at, Message.id) < (cursor_created_at, after_id))
+        stmt = Message.list_select().where(*filters).order_by(*order)
+        if per_page > _STREAM_PAGE_SIZE:
+            return current_app.response_class(
+                stream_with_context(_stream_messages(stmt, per_page)),
+                mimetype='application/json'
+            )
+        messages, has_more = _keyset_slice(stmt, per_page)
         
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        next_cursor = None
+        if has_more:
+            last = messages[-1]
+            next_cursor = {'after_created_at': last.created_at.isoformat(), 'after_id': last.id}
         
         return jsonify({
             'success': True,
-            'messages': [m.to_dict() for m in pagination.items],
-            'total': pagination.total,
-            'pages': pagination.pages,
-            'current_page': page
+            'messages': [Message.row_dict(m) for m in messages],
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
         logger.exception("Error fetching messages")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _stream_messages(stmt, per_page):
+    """Yield the get_messages JSON body one row at a time, with next_cursor last."""
+    rows = db.session.execute(
+        stmt.limit(per_page + 1).execution_options(yield_per=500, stream_results=True)
+    )
+    yield b'{"success":true,"messages":['
+    last = None
+    next_cursor = None
+    for n, row in enumerate(rows):
+        if n == per_page:
+            next_cursor = {'after_created_at': last.created_at.isoformat(), 'after_id': last.id}
+            break
+        yield (b',' if n else b'') + orjson.dumps(Message.row_dict(row))
+        last = row
+    rows.close()
+    yield b'],"next_cursor":' + orjson.dumps(next_cursor) + b'}'
+
 
 # ----- Public contact form (invite link) -----
 @main_bp.route('/form/<token>', methods=['GET'])
@@ -592,9 +789,10 @@ def public_contact_submit(token):
     gid = verify_group_token(token)
     group = Group.query.get_or_404(gid)
 
-    # Accept application/x-www-form-urlencoded or JSON
-    name = (request.form.get('name') or (request.json or {}).get('name') or '').strip()
-    phone = (request.form.get('whatsapp_number') or (request.json or {}).get('whatsapp_number') or '').strip()
+    # Accept application/x-www-form-urlencoded or JSON; parse the body once
+    payload = request.form if request.form else (request.get_json(silent=True) or {})
+    name = (payload.get('name') or '').strip()
+    phone = (payload.get('whatsapp_number') or '').strip()
 
     if not name or not phone:
         err = 'Nome e WhatsApp são obrigatórios.'
@@ -611,17 +809,8 @@ def public_contact_submit(token):
 
     try:
         # Upsert contact by phone
-        existing = Contact.query.filter_by(whatsapp_number=normalized_phone).first()
-        if existing:
-            existing.name = name
-            if existing.group_id is None:
-                existing.group_id = group.id
-            db.session.commit()
-            contact = existing
-        else:
-            contact = Contact(name=name, whatsapp_number=normalized_phone, group_id=group.id)
-            db.session.add(contact)
-            db.session.commit()
+        contact = Contact.upsert(name, normalized_phone, group.id)
+        db.session.commit()
 
         if request.is_json:
             return jsonify({'success': True, 'contact': contact.to_dict(), 'message': 'Cadastro recebido com sucesso!'}), 201
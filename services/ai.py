@@ -1,19 +1,81 @@
-import requests
-import json
+import httpx
+import hashlib
 import re
-from typing import Optional, Dict, List
+from threading import Event, Lock
+from typing import Optional, Dict, Iterator, List
+import orjson
+from cachetools import TTLCache
 from loguru import logger
 from config import Config
 
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# Bodies are pre-encoded with orjson, so the content type is set explicitly
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# (connect, read) timeouts for provider calls
+_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+# Sanitizer pattern, compiled once
+_RE_URL = re.compile(r'https?://\S+')
+
+# Static instruction sent ahead of every prompt. Kept byte-identical and first in the
+# conversation, with an explicit cache breakpoint, so providers that cache prompt
+# prefixes (Anthropic via OpenRouter, OpenAI automatically) can reuse it.
+_SYSTEM_PROMPT = (
+    "You are a helpful assistant that creates short, WhatsApp-compatible messages. "
+    "Keep messages concise, friendly, and under 500 characters. "
+    "Avoid using links or excessive emojis."
+)
+_SYSTEM_CONTENT = [
+    {"type": "text", "text": _SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+]
+
+# Successful compositions are reused briefly so double submits and client retries of the
+# compose route don't pay twice; sampling is non-deterministic, so a longer reuse would
+# hand back the same draft when the user asks again for a new one (see regenerate)
+_COMPOSE_CACHE_SIZE = 1024
+_COMPOSE_CACHE_TTL = 60
+
+class _Call:
+    """A composition in progress; callers with the same key wait on done and read result."""
+    
+    def __init__(self):
+        self.done = Event()
+        self.result: Dict = {"success": False, "error": "Message composition failed"}
+
 class AIService:
     """Service for AI-powered message composition."""
     
+    def __init__(self):
+        # One keep-alive pool per service so repeated compositions skip the TCP/TLS handshake;
+        # HTTP/2 lets concurrent compositions share a single OpenRouter connection
+        self._client = httpx.Client(
+            http2=True,
+            timeout=_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=30.0),
+        )
+        self._compose_cache = TTLCache(maxsize=_COMPOSE_CACHE_SIZE, ttl=_COMPOSE_CACHE_TTL)
+        self._compose_cache_lock = Lock()
+        # Compositions in progress, by cache key; guarded by _compose_cache_lock
+        self._inflight: Dict[bytes, _Call] = {}
+    
+    def warmup(self) -> None:
+        """Open the OpenRouter connection ahead of the first composition; failures are ignored."""
+        if not Config.OPENROUTER_API_KEY:
+            return
+        try:
+            self._client.head(OPENROUTER_URL, timeout=5.0)
+        except httpx.HTTPError as e:
+            logger.debug(f"OpenRouter warmup failed: {e}")
+    
     def compose_message(
         self,
         topic: str,
         tone: str = "friendly",
         placeholders: Optional[Dict] = None,
-        provider: str = "openrouter"
+        provider: str = "openrouter",
+        regenerate: bool = False
     ) -> Dict:
         """
         Compose a message using AI.
@@ -23,10 +85,39 @@ class AIService:
             tone: The tone of the message (friendly, formal, casual, urgent)
             placeholders: Dictionary of placeholders to include in the message
             provider: AI provider to use (openrouter or ollama)
+            regenerate: Skip the cached composition and ask the provider for a new draft
         
         Returns:
             Dictionary with composed message or error
         """
+        key = self._compose_key(topic, tone, placeholders, provider)
+        with self._compose_cache_lock:
+            cached = None if regenerate else self._compose_cache.get(key)
+            call = self._inflight.get(key) if cached is None else None
+            leader = cached is None and call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+        if cached is not None:
+            return dict(cached)
+        
+        # An identical composition is already running; share its result instead of paying twice
+        if not leader:
+            call.done.wait()
+            return dict(call.result)
+        
+        try:
+            call.result = self._compose(topic, tone, placeholders, provider)
+            # Errors are never cached so the next call retries the provider
+            if call.result["success"]:
+                with self._compose_cache_lock:
+                    self._compose_cache[key] = dict(call.result)
+        finally:
+            with self._compose_cache_lock:
+                del self._inflight[key]
+            call.done.set()
+        return dict(call.result)
+    
+    def _compose(self, topic: str, tone: str, placeholders: Optional[Dict], provider: str) -> Dict:
         if provider == "openrouter":
             return self._compose_with_openrouter(topic, tone, placeholders)
         elif provider == "ollama":
@@ -37,6 +128,37 @@ class AIService:
                 "error": f"Unknown AI provider: {provider}"
             }
     
+    @staticmethod
+    def _compose_key(topic: str, tone: str, placeholders: Optional[Dict], provider: str) -> bytes:
+        """Digest of the inputs that determine the prompt."""
+        raw = f"{provider}|{topic}|{tone}|".encode() + orjson.dumps(
+            placeholders, option=orjson.OPT_SORT_KEYS, default=str
+        )
+        return hashlib.blake2b(raw, digest_size=16).digest()
+    
+    def stream_message(
+        self,
+        topic: str,
+        tone: str = "friendly",
+        placeholders: Optional[Dict] = None,
+        provider: str = "openrouter"
+    ) -> Iterator[str]:
+        """
+        Yield message text as the provider generates it.
+        
+        Chunks are raw model output; join them and pass the result through
+        _sanitize_message before sending it anywhere.
+        
+        Raises:
+            ValueError: Unknown provider
+            httpx.HTTPError: Connection failure or non-200 provider response
+        """
+        if provider == "openrouter":
+            return self._stream_openrouter(topic, tone, placeholders)
+        elif provider == "ollama":
+            return self._stream_ollama(topic, tone, placeholders)
+        raise ValueError(f"Unknown AI provider: {provider}")
+    
     def _compose_with_openrouter(self, topic: str, tone: str, placeholders: Optional[Dict]) -> Dict:
         """Compose message using OpenRouter API."""
         
@@ -47,55 +169,20 @@ class AIService:
             }
         
         try:
-            # Build the prompt
-            prompt = self._build_prompt(topic, tone, placeholders)
+            message = "".join(self._stream_openrouter(topic, tone, placeholders))
             
-            # OpenRouter API endpoint
-            url = "https://openrouter.ai/api/v1/chat/completions"
+            # Sanitize the message
+            message = self._sanitize_message(message)
             
-            headers = {
-                "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://github.com/zapi-whatsapp",
-                "X-Title": "Z-API WhatsApp Sender"
+            return {
+                "success": True,
+                "message": message
             }
-            
-            payload = {
-                "model": "openai/gpt-3.5-turbo",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that creates short, WhatsApp-compatible messages. Keep messages concise, friendly, and under 500 characters. Avoid using links or excessive emojis."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "max_tokens": 150,
-                "temperature": 0.7
+        except httpx.HTTPStatusError as e:
+            return {
+                "success": False,
+                "error": f"OpenRouter API error: {e.response.status_code}"
             }
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                message = data["choices"][0]["message"]["content"]
-                
-                # Sanitize the message
-                message = self._sanitize_message(message)
-                
-                return {
-                    "success": True,
-                    "message": message
-                }
-            else:
-                logger.error(f"OpenRouter API error: {response.status_code} - {response.text}")
-                return {
-                    "success": False,
-                    "error": f"OpenRouter API error: {response.status_code}"
-                }
-                
         except Exception as e:
             logger.exception("Error composing message with OpenRouter")
             return {
@@ -103,47 +190,75 @@ class AIService:
                 "error": str(e)
             }
     
+    def _stream_openrouter(self, topic: str, tone: str, placeholders: Optional[Dict]) -> Iterator[str]:
+        """Yield completion deltas from OpenRouter's server-sent event stream."""
+        # Build the prompt
+        prompt = self._build_prompt(topic, tone, placeholders)
+        
+        headers = {
+            "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://github.com/zapi-whatsapp",
+            "X-Title": "Z-API WhatsApp Sender"
+        }
+        
+        payload = {
+            "model": "openai/gpt-3.5-turbo",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": _SYSTEM_CONTENT
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "max_tokens": 150,
+            "temperature": 0.7,
+            "stream": True
+        }
+        
+        with self._client.stream("POST", OPENROUTER_URL, content=orjson.dumps(payload), headers=headers) as response:
+            if response.status_code != 200:
+                logger.error(f"OpenRouter API error: {response.status_code} - {response.read().decode(errors='replace')}")
+                raise httpx.HTTPStatusError(
+                    f"OpenRouter API error: {response.status_code}", request=response.request, response=response
+                )
+            
+            # "data: {...}" events, ": ..." keep-alive comments, "data: [DONE]" at the end
+            for line in response.iter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[6:]
+                if data == "[DONE]":
+                    break
+                event = orjson.loads(data)
+                if "error" in event:
+                    raise RuntimeError(f"OpenRouter stream error: {event['error']}")
+                chunk = event["choices"][0].get("delta", {}).get("content")
+                if chunk:
+                    yield chunk
+    
     def _compose_with_ollama(self, topic: str, tone: str, placeholders: Optional[Dict]) -> Dict:
         """Compose message using Ollama local API."""
         
         try:
-            # Build the prompt
-            prompt = self._build_prompt(topic, tone, placeholders)
+            message = "".join(self._stream_ollama(topic, tone, placeholders))
             
-            # Ollama API endpoint
-            url = f"{Config.OLLAMA_HOST}/api/generate"
+            # Sanitize the message
+            message = self._sanitize_message(message)
             
-            payload = {
-                "model": "llama2",  # You can change this to any model you have installed
-                "prompt": f"Create a short WhatsApp message (under 500 characters) that is {tone} in tone. {prompt}",
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "max_tokens": 150
-                }
+            return {
+                "success": True,
+                "message": message
             }
-            
-            response = requests.post(url, json=payload, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                message = data.get("response", "")
-                
-                # Sanitize the message
-                message = self._sanitize_message(message)
-                
-                return {
-                    "success": True,
-                    "message": message
-                }
-            else:
-                logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-                return {
-                    "success": False,
-                    "error": f"Ollama API error: {response.status_code}"
-                }
-                
-        except requests.ConnectionError:
+        except httpx.HTTPStatusError as e:
+            return {
+                "success": False,
+                "error": f"Ollama API error: {e.response.status_code}"
+            }
+        except (httpx.ConnectError, httpx.ConnectTimeout):
             return {
                 "success": False,
                 "error": "Cannot connect to Ollama. Make sure Ollama is running locally."
@@ -155,6 +270,40 @@ class AIService:
                 "error": str(e)
             }
     
+    def _stream_ollama(self, topic: str, tone: str, placeholders: Optional[Dict]) -> Iterator[str]:
+        """Yield response fragments from Ollama's JSON-lines stream."""
+        # Build the prompt
+        prompt = self._build_prompt(topic, tone, placeholders)
+        
+        # Ollama API endpoint
+        url = f"{Config.OLLAMA_HOST}/api/generate"
+        
+        payload = {
+            "model": "llama2",  # You can change this to any model you have installed
+            "prompt": f"Create a short WhatsApp message (under 500 characters) that is {tone} in tone. {prompt}",
+            "stream": True,
+            "options": {
+                "temperature": 0.7,
+                "max_tokens": 150
+            }
+        }
+        
+        with self._client.stream("POST", url, content=orjson.dumps(payload), headers=_JSON_HEADERS) as response:
+            if response.status_code != 200:
+                logger.error(f"Ollama API error: {response.status_code} - {response.read().decode(errors='replace')}")
+                raise httpx.HTTPStatusError(
+                    f"Ollama API error: {response.status_code}", request=response.request, response=response
+                )
+            
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = orjson.loads(line)
+                if event.get("response"):
+                    yield event["response"]
+                if event.get("done"):
+                    break
+    
     def _build_prompt(self, topic: str, tone: str, placeholders: Optional[Dict]) -> str:
         """Build the prompt for AI message composition."""
         prompt = f"Create a message about: {topic}. "
@@ -169,11 +318,13 @@ class AIService:
     
     def _sanitize_message(self, message: str) -> str:
         """Sanitize AI-generated message for WhatsApp."""
-        # Remove excessive line breaks
-        message = re.sub(r'\n{3,}', '\n\n', message)
+        # Collapse runs of 3+ line breaks to 2; a literal replace loop avoids the regex engine
+        while '\n\n\n' in message:
+            message = message.replace('\n\n\n', '\n\n')
         
-        # Remove potential harmful links
-        message = re.sub(r'https?://[^\s]+', '[link removed]', message)
+        # Remove potential harmful links; most replies have none, so skip the regex then
+        if '://' in message:
+            message = _RE_URL.sub('[link removed]', message)
         
         # Trim to reasonable length
         if len(message) > 1000:
@@ -0,0 +1,118 @@
+import copy
+import threading
+from typing import Any, Dict, Optional
+import orjson
+from loguru import logger
+from config import Config
+
+class MemoryJobStore:
+    """Process-local job status store, used when no Redis is configured or reachable."""
+    
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+    
+    def create(self, job_id: str, fields: Dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs[job_id] = dict(fields, results=[])
+    
+    def update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            self._jobs[job_id].update(fields)
+    
+    def incr(self, job_id: str, field: str, amount: int = 1) -> None:
+        with self._lock:
+            self._jobs[job_id][field] += amount
+    
+    def append_result(self, job_id: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs[job_id]["results"].append(result)
+    
+    def finish(self, job_id: str, **fields) -> None:
+        self.update(job_id, **fields)
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job is not None else None
+
+class RedisJobStore:
+    """Job status shared across processes: a hash of orjson-encoded fields plus a results list."""
+    
+    def __init__(self, client, ttl: int):
+        self._redis = client
+        self._ttl = ttl
+    
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"zapi:job:{job_id}"
+    
+    @staticmethod
+    def _encode(fields: Dict[str, Any]) -> Dict[str, bytes]:
+        return {k: orjson.dumps(v) for k, v in fields.items()}
+    
+    def create(self, job_id: str, fields: Dict[str, Any]) -> None:
+        key = self._key(job_id)
+        pipe = self._redis.pipeline()
+        pipe.hset(key, mapping=self._encode(fields))
+        # Unfinished jobs still expire eventually if the worker dies
+        pipe.expire(key, self._ttl)
+        pipe.execute()
+    
+    def update(self, job_id: str, **fields) -> None:
+        self._redis.hset(self._key(job_id), mapping=self._encode(fields))
+    
+    def incr(self, job_id: str, field: str, amount: int = 1) -> None:
+        # orjson encodes ints as bare digits, so HINCRBY works on them directly
+        self._redis.hincrby(self._key(job_id), field, amount)
+    
+    def append_result(self, job_id: str, result: Dict[str, Any]) -> None:
+        key = self._key(job_id) + ":results"
+        pipe = self._redis.pipeline()
+        pipe.rpush(key, orjson.dumps(result))
+        pipe.expire(key, self._ttl)
+        pipe.execute()
+    
+    def finish(self, job_id: str, **fields) -> None:
+        key = self._key(job_id)
+        pipe = self._redis.pipeline()
+        pipe.hset(key, mapping=self._encode(fields))
+        pipe.expire(key, self._ttl)
+        pipe.expire(key + ":results", self._ttl)
+        pipe.execute()
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        key = self._key(job_id)
+        pipe = self._redis.pipeline()
+        pipe.hgetall(key)
+        pipe.lrange(key + ":results", 0, -1)
+        raw, results = pipe.execute()
+        if not raw:
+            return None
+        job = {k.decode(): orjson.loads(v) for k, v in raw.items()}
+        job["results"] = [orjson.loads(r) for r in results]
+        return job
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_job_store():
+    """Get or create the job store, falling back to process memory if Redis is unavailable."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _create_store(Config.JOB_STORE_URI)
+    return _store
+
+def _create_store(uri: str):
+    if not uri.startswith(('redis://', 'rediss://')):
+        return MemoryJobStore()
+    import redis
+    try:
+        client = redis.Redis.from_url(uri, socket_connect_timeout=2)
+        client.ping()
+    except redis.RedisError as e:
+        logger.warning(f"Job store Redis unavailable ({e}); keeping job status in process memory")
+        return MemoryJobStore()
+    return RedisJobStore(client, Config.JOB_STATUS_TTL)
@@ -2,16 +2,45 @@ import time
 import threading
 import uuid
 from datetime import datetime
-from typing import Optional, Union, Dict, List
+from collections import namedtuple
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Union, Dict, List, Tuple
 from loguru import logger
 from flask import current_app
-from models import db, Contact, Message, Group
+from models import db, Contact, Message, Group, UTC
 from utils.phone import normalize_to_e164
 from services.zapi_client import get_client
+from services.job_store import get_job_store
+from config import Config
 
-# In-memory job storage (for demo purposes)
-# In production, use Redis or a database
-jobs_status = {}
+# Message rows are written in batches of this size during bulk sends
+_RECORD_BATCH = 50
+
+# Plain snapshot of a contact, safe to hand to worker threads and to read after commits
+_Recipient = namedtuple('_Recipient', 'id name whatsapp_number')
+
+def _job_timestamp() -> str:
+    """Timezone-aware ISO timestamp for job status; status lives outside the naive-UTC database."""
+    return datetime.now(UTC).isoformat()
+
+class _Pacer:
+    """Hands out send slots no closer together than interval seconds, across threads."""
+    
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def wait(self, stop: threading.Event) -> bool:
+        """Block until the next slot; False if stop was set first."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self._interval
+        if slot > now:
+            return not stop.wait(slot - now)
+        return not stop.is_set()
 
 class MessagingService:
     """Service for handling message sending operations."""
@@ -19,17 +48,40 @@ class MessagingService:
     def __init__(self):
         self.zapi_client = get_client()
     
-    def send_to_contact(self, contact_or_phone: Union[int, str, Contact], message: str) -> Dict:
+    def send_to_contact(self, contact_or_phone: Union[int, str, Contact], message: str, commit: bool = True) -> Dict:
         """
         Send a message to a contact or phone number.
         
         Args:
             contact_or_phone: Contact ID, Contact object, or phone number string
             message: Message content
+            commit: Commit the message record; when False it is only flushed and the caller commits
         
         Returns:
             Dictionary with send result
         """
+        result, record = self._deliver(contact_or_phone, message)
+        if record is None:
+            return result
+        
+        # Create message record
+        msg_record = Message(**record)
+        db.session.add(msg_record)
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
+        
+        result["message_id"] = msg_record.id
+        return result
+    
+    def _deliver(self, contact_or_phone: Union[int, str, Contact], message: str) -> Tuple[Dict, Optional[Dict]]:
+        """
+        Send a message without persisting it.
+        
+        Returns:
+            Tuple of (send result, Message column mapping or None if nothing was sent)
+        """
         contact = None
         phone_number = None
         
@@ -38,12 +90,12 @@ class MessagingService:
             contact = contact_or_phone
             phone_number = contact.whatsapp_number
         elif isinstance(contact_or_phone, int):
-            contact = Contact.query.get(contact_or_phone)
+            contact = db.session.get(Contact, contact_or_phone)
             if not contact:
                 return {
                     "success": False,
                     "error": f"Contact with ID {contact_or_phone} not found"
-                }
+                }, None
             phone_number = contact.whatsapp_number
         else:
             # It's a phone number string
@@ -53,33 +105,81 @@ class MessagingService:
                 return {
                     "success": False,
                     "error": str(e)
-                }
+                }, None
         
-        # Send the message via Z-API
+        return self._deliver_to(contact.id if contact else None, phone_number, message)
+    
+    def _deliver_to(self, contact_id: Optional[int], phone_number: str, message: str) -> Tuple[Dict, Dict]:
+        """Send to a resolved number and build its Message column mapping."""
         result = self.zapi_client.send_text(phone_number, message)
         
-        # Create message record
-        msg_record = Message(
-            contact_id=contact.id if contact else None,
-            phone_number=phone_number if not contact else None,
-            content=message,
-            status=result["status"],
-            provider="z-api",
-            provider_message_id=result.get("provider_message_id"),
-            error=result.get("error"),
-            created_at=datetime.utcnow()
-        )
-        
-        db.session.add(msg_record)
-        db.session.commit()
+        record = {
+            "contact_id": contact_id,
+            "phone_number": phone_number if contact_id is None else None,
+            "content": message,
+            "status": result["status"],
+            "provider": "z-api",
+            "provider_message_id": result.get("provider_message_id"),
+            "error": result.get("error")
+        }
         
         return {
             "success": result["success"],
-            "message_id": msg_record.id,
+            "message_id": None,
             "status": result["status"],
             "error": result.get("error"),
             "provider_message_id": result.get("provider_message_id")
-        }
+        }, record
+    
+    @staticmethod
+    def _group_recipients(group_id: int) -> Optional[List[_Recipient]]:
+        """Load a group's contacts as plain recipients in one column query; None if the group is missing."""
+        rows = db.session.execute(
+            db.select(Contact.id, Contact.name, Contact.whatsapp_number)
+            .where(Contact.group_id == group_id)
+            .order_by(Contact.id)
+        ).all()
+        if not rows and db.session.get(Group, group_id) is None:
+            return None
+        return [_Recipient(*row) for row in rows]
+    
+    def _deliver_paced(self, recipients: List[_Recipient], message: str, sleep_between_secs: float):
+        """
+        Deliver to recipients from a thread pool, starting sends at most once per interval.
+        
+        Network time overlaps across workers, so a job takes about (N-1) * interval
+        instead of N * (interval + request latency).
+        
+        Closing the generator (callers use contextlib.closing) cancels every send that
+        has not started yet, so nothing goes out once the caller has given up.
+        
+        Yields:
+            (index, recipient, send result, Message column mapping) as sends finish
+        """
+        app = current_app._get_current_object()
+        pacer = _Pacer(sleep_between_secs)
+        stop = threading.Event()
+        total = len(recipients)
+        
+        def task(idx, recipient):
+            if not pacer.wait(stop):
+                return None
+            logger.info(f"Sending message {idx + 1}/{total} to {recipient.name}")
+            # Settings lookups in the client need an app context in this thread
+            with app.app_context():
+                return self._deliver_to(recipient.id, recipient.whatsapp_number, message)
+        
+        pool = ThreadPoolExecutor(max_workers=max(1, min(Config.BULK_SEND_WORKERS, total)))
+        try:
+            futures = {pool.submit(task, idx, r): (idx, r) for idx, r in enumerate(recipients)}
+            for future in as_completed(futures):
+                idx, recipient = futures[future]
+                result, record = future.result()
+                yield idx, recipient, result, record
+        finally:
+            # Reached early only if the caller stopped consuming or a send raised
+            stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
     
     def send_bulk_by_group(self, group_id: int, message: str, sleep_between_secs: float = 2.0) -> List[Dict]:
         """
@@ -93,35 +193,38 @@ class MessagingService:
         Returns:
             List of send results for each contact
         """
-        group = Group.query.get(group_id)
-        if not group:
+        recipients = self._group_recipients(group_id)
+        if recipients is None:
             return [{"success": False, "error": f"Group with ID {group_id} not found"}]
-        
-        contacts = group.contacts.all()
-        if not contacts:
+        if not recipients:
             return [{"success": False, "error": "No contacts in group"}]
         
-        results = []
-        total = len(contacts)
+        results = [None] * len(recipients)
+        records = []
         
-        for idx, contact in enumerate(contacts, 1):
-            logger.info(f"Sending message {idx}/{total} to {contact.name}")
-            
-            # Send message
-            result = self.send_to_contact(contact, message)
-            result["contact_name"] = contact.name
-            result["contact_id"] = contact.id
-            results.append(result)
-            
-            # Rate limiting: wait between messages (except for the last one)
-            if idx < total:
-                time.sleep(sleep_between_secs)
+        try:
+            with closing(self._deliver_paced(recipients, message, sleep_between_secs)) as sends:
+                for idx, contact, result, record in sends:
+                    if record is not None:
+                        records.append(record)
+                        if len(records) >= _RECORD_BATCH:
+                            Message.bulk_record(records)
+                            records = []
+                    result["contact_name"] = contact.name
+                    result["contact_id"] = contact.id
+                    results[idx] = result
+        finally:
+            # Persist the remaining message records
+            Message.bulk_record(records)
         
         return results
     
     def send_bulk_async(self, group_id: int, message: str, sleep_between_secs: float = 2.0) -> str:
         """
-        Send bulk messages asynchronously in a background thread.
+        Send bulk messages asynchronously.
+        
+        The job is queued on the application scheduler, whose jobstore persists it
+        until it starts; without a running scheduler it falls back to a thread.
         
         Args:
             group_id: Group ID
@@ -131,87 +234,102 @@ class MessagingService:
         Returns:
             Job ID for status tracking
         """
-        job_id = str(uuid.uuid4())
+        job_id = uuid.uuid4().hex
         
         # Initialize job status
-        jobs_status[job_id] = {
+        get_job_store().create(job_id, self._new_job_status(job_id))
+        
+        from services.scheduler import enqueue_bulk_send
+        if enqueue_bulk_send(job_id, group_id, message, sleep_between_secs):
+            return job_id
+        
+        # Bind the real app now; the worker thread has no request or app context
+        app = current_app._get_current_object()
+        
+        def run_bulk_send():
+            with app.app_context():
+                self.run_bulk_job(job_id, group_id, message, sleep_between_secs)
+        
+        # Start background thread
+        thread = threading.Thread(target=run_bulk_send)
+        thread.daemon = True
+        thread.start()
+        
+        return job_id
+    
+    @staticmethod
+    def _new_job_status(job_id: str) -> Dict:
+        return {
             "id": job_id,
             "status": "pending",
             "progress": 0,
             "total": 0,
             "sent": 0,
             "failed": 0,
-            "started_at": datetime.utcnow().isoformat(),
-            "completed_at": None,
-            "results": []
+            "started_at": _job_timestamp(),
+            "completed_at": None
         }
-        
-        def run_bulk_send():
-            with current_app.app_context():
-                try:
-                    # Update status to running
-                    jobs_status[job_id]["status"] = "running"
-                    
-                    # Get group and contacts
-                    group = Group.query.get(group_id)
-                    if not group:
-                        jobs_status[job_id]["status"] = "failed"
-                        jobs_status[job_id]["error"] = f"Group with ID {group_id} not found"
-                        return
-                    
-                    contacts = group.contacts.all()
-                    total = len(contacts)
-                    jobs_status[job_id]["total"] = total
-                    
-                    if not contacts:
-                        jobs_status[job_id]["status"] = "failed"
-                        jobs_status[job_id]["error"] = "No contacts in group"
-                        return
-                    
-                    # Send messages
-                    for idx, contact in enumerate(contacts, 1):
-                        result = self.send_to_contact(contact, message)
+    
+    def run_bulk_job(self, job_id: str, group_id: int, message: str, sleep_between_secs: float) -> None:
+        """Execute a bulk send queued by send_bulk_async. Must be called within an app context."""
+        store = get_job_store()
+        # A process-local store loses entries across restarts; the persisted job may outlive it
+        if store.get(job_id) is None:
+            store.create(job_id, self._new_job_status(job_id))
+        try:
+            # Update status to running
+            store.update(job_id, status="running")
+            
+            # Get group contacts
+            recipients = self._group_recipients(group_id)
+            if recipients is None:
+                store.finish(job_id, status="failed", error=f"Group with ID {group_id} not found")
+                return
+            
+            total = len(recipients)
+            store.update(job_id, total=total)
+            
+            if not recipients:
+                store.finish(job_id, status="failed", error="No contacts in group")
+                return
+            
+            # Send messages
+            records = []
+            try:
+                with closing(self._deliver_paced(recipients, message, sleep_between_secs)) as sends:
+                    for done, (_, contact, result, record) in enumerate(sends, 1):
+                        if record is not None:
+                            records.append(record)
+                            if len(records) >= _RECORD_BATCH:
+                                Message.bulk_record(records)
+                                records = []
                         
                         # Update progress
-                        jobs_status[job_id]["progress"] = idx
-                        if result["success"]:
-                            jobs_status[job_id]["sent"] += 1
-                        else:
-                            jobs_status[job_id]["failed"] += 1
+                        store.update(job_id, progress=done)
+                        store.incr(job_id, "sent" if result["success"] else "failed")
                         
                         # Store result
-                        jobs_status[job_id]["results"].append({
+                        store.append_result(job_id, {
                             "contact_name": contact.name,
                             "contact_id": contact.id,
                             "success": result["success"],
                             "error": result.get("error")
                         })
-                        
-                        # Rate limiting
-                        if idx < total:
-                            time.sleep(sleep_between_secs)
-                    
-                    # Mark as completed
-                    jobs_status[job_id]["status"] = "completed"
-                    jobs_status[job_id]["completed_at"] = datetime.utcnow().isoformat()
-                    
-                except Exception as e:
-                    logger.exception(f"Error in bulk send job {job_id}")
-                    jobs_status[job_id]["status"] = "failed"
-                    jobs_status[job_id]["error"] = str(e)
-                    jobs_status[job_id]["completed_at"] = datetime.utcnow().isoformat()
-        
-        # Start background thread
-        thread = threading.Thread(target=run_bulk_send)
-        thread.daemon = True
-        thread.start()
-        
-        return job_id
+            finally:
+                # Persist the remaining message records
+                Message.bulk_record(records)
+            
+            # Mark as completed
+            store.finish(job_id, status="completed", completed_at=_job_timestamp())
+            
+        except Exception as e:
+            logger.exception(f"Error in bulk send job {job_id}")
+            store.finish(job_id, status="failed", error=str(e), completed_at=_job_timestamp())
     
     @staticmethod
     def get_job_status(job_id: str) -> Optional[Dict]:
         """Get the status of a bulk send job."""
-        return jobs_status.get(job_id)
+        return get_job_store().get(job_id)
 
 # Singleton instance
 _service = None
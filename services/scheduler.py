@@ -1,14 +1,19 @@
+import re
 import uuid
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional, Dict, Any, List
 
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.cron import CronTrigger
 from loguru import logger
 from flask import current_app, Flask
 
-from models import db, ScheduledMessage
+from config import Config
+from models import db, ScheduledMessage, utcnow
 from services.messaging import get_messaging_service
 
 # Global scheduler instance
@@ -16,13 +21,32 @@ scheduler: Optional[BackgroundScheduler] = None
 # Keep a reference to the Flask app to create app contexts in background threads
 _flask_app: Optional[Flask] = None
 
+# Table used by APScheduler's persistent jobstore
+JOBSTORE_TABLE = 'apscheduler_jobs'
+
+
+def create_scheduler() -> BackgroundScheduler:
+    """Build a scheduler whose jobs persist in the application database.
+
+    Must be called within an app context (uses db.engine).
+    """
+    return BackgroundScheduler(
+        jobstores={'default': SQLAlchemyJobStore(engine=db.engine, tablename=JOBSTORE_TABLE)},
+        executors={'default': ThreadPoolExecutor(max_workers=Config.SCHEDULER_WORKERS)},
+        job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 60},
+    )
+
 
 def init_scheduler(app) -> None:
-    """Initialize and start the APScheduler, restore pending jobs from DB."""
+    """Initialize and start the APScheduler, reconciling pending jobs from DB."""
     global scheduler, _flask_app
+    started = False
     if scheduler is None:
-        scheduler = BackgroundScheduler()
-        scheduler.start()
+        with app.app_context():
+            scheduler = create_scheduler()
+        # Start paused so persisted jobs don't fire before reconciliation
+        scheduler.start(paused=True)
+        started = True
         logger.info("APScheduler started")
 
     # Keep app reference for background jobs
@@ -35,28 +59,64 @@ def init_scheduler(app) -> None:
     with app.app_context():
         restore_pending_jobs()
 
+    if started:
+        scheduler.resume()
+
 
 def restore_pending_jobs() -> None:
-    """Restore pending scheduled jobs from the database into the scheduler."""
-    pending: List[ScheduledMessage] = (
-        ScheduledMessage.query.filter(ScheduledMessage.status == 'scheduled').all()
-    )
+    """Reconcile scheduled rows with the persistent jobstore.
+
+    APScheduler reloads its own jobs from the jobstore; this only re-adds rows
+    whose job is missing (e.g. created before the jobstore existed) and fails
+    past-due one-time schedules.
+    """
+    assert scheduler is not None
+    S = ScheduledMessage
+    now = utcnow()
+    known = {job.id for job in scheduler.get_jobs()}
+
+    # Fail past-due one-time schedules in one statement and drop their leftover jobs
+    past_due = (S.status == 'scheduled') & (S.schedule_type == 'once') & (S.run_at <= now)
+    stale_jobs = db.session.execute(db.select(S.job_id).where(past_due)).scalars().all()
+    if stale_jobs:
+        db.session.execute(
+            db.update(S).where(past_due).values(status='failed'),
+            execution_options={'synchronize_session': False},
+        )
+        # Release the write lock before the jobstore's own connection writes (SQLite)
+        db.session.commit()
+        for job_id in stale_jobs:
+            if job_id in known:
+                scheduler.remove_job(job_id)
+
+    # Only the trigger columns are needed to rebuild jobs
+    pending = db.session.execute(
+        db.select(S.id, S.job_id, S.schedule_type, S.run_at, S.cron_expression)
+        .where(S.status == 'scheduled')
+        .where(
+            ((S.schedule_type == 'once') & (S.run_at > now))
+            | ((S.schedule_type == 'cron') & S.cron_expression.isnot(None))
+        )
+    ).all()
     restored = 0
+    failed = []
     for sched in pending:
+        if sched.job_id in known:
+            continue
         try:
-            if sched.schedule_type == 'once' and sched.run_at:
-                # Skip past-due one-time schedules, mark failed
-                if sched.run_at <= datetime.utcnow():
-                    sched.status = 'failed'
-                    continue
+            if sched.schedule_type == 'once':
                 _add_date_job(sched)
-                restored += 1
-            elif sched.schedule_type == 'cron' and sched.cron_expression:
+            else:
                 _add_cron_job(sched)
-                restored += 1
+            restored += 1
         except Exception:
             logger.exception(f"Failed to restore schedule {sched.id}")
-            sched.status = 'failed'
+            failed.append(sched.id)
+    if failed:
+        db.session.execute(
+            db.update(S).where(S.id.in_(failed)).values(status='failed'),
+            execution_options={'synchronize_session': False},
+        )
     db.session.commit()
     logger.info(f"Restored {restored} scheduled jobs")
 
@@ -75,11 +135,16 @@ def _add_date_job(sched: ScheduledMessage) -> None:
     )
 
 
+_CRON_RE = re.compile(r'\s*(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s*\Z')
+
+
+# Triggers are not mutated after construction, so jobs sharing an expression can share one
+@lru_cache(maxsize=256)
 def _parse_cron_expression(expr: str) -> CronTrigger:
-    parts = [p.strip() for p in expr.split()]  # standard 5-field cron
-    if len(parts) != 5:
+    m = _CRON_RE.match(expr)  # standard 5-field cron
+    if not m:
         raise ValueError("Cron expression must have 5 fields: minute hour day month day_of_week")
-    minute, hour, day, month, day_of_week = parts
+    minute, hour, day, month, day_of_week = m.groups()
     return CronTrigger(minute=minute, hour=hour, day=day, month=month, day_of_week=day_of_week)
 
 
@@ -97,6 +162,36 @@ def _add_cron_job(sched: ScheduledMessage) -> None:
     )
 
 
+def enqueue_bulk_send(job_id: str, group_id: int, message: str, sleep_between_secs: float) -> bool:
+    """Queue a bulk send to run now on the scheduler. Returns False if no scheduler is running."""
+    if scheduler is None or not scheduler.running:
+        return False
+    scheduler.add_job(
+        func=run_bulk_job,
+        trigger=DateTrigger(),
+        id=f"bulk-{job_id}",
+        kwargs={
+            'job_id': job_id,
+            'group_id': group_id,
+            'message': message,
+            'sleep_between_secs': sleep_between_secs,
+        },
+        replace_existing=True,
+        # Still run if the process was down when it was due
+        misfire_grace_time=None,
+    )
+    return True
+
+
+def run_bulk_job(job_id: str, group_id: int, message: str, sleep_between_secs: float) -> None:
+    """Job function for bulk sends queued by enqueue_bulk_send."""
+    if _flask_app is None:
+        logger.error("No Flask app context available for scheduler job; aborting run_bulk_job")
+        return
+    with _flask_app.app_context():
+        get_messaging_service().run_bulk_job(job_id, group_id, message, sleep_between_secs)
+
+
 def run_send_job(scheduled_id: int) -> None:
     """Job function that performs the actual send using MessagingService."""
     # Ensure we have a Flask app context even when running in APScheduler threads
@@ -125,10 +220,12 @@ def run_send_job(scheduled_id: int) -> None:
 
             if sched.type == 'individual':
                 if sched.contact_id:
-                    result = messaging.send_to_contact(sched.contact_id, sched.message)
+                    # The contact is joined-loaded with the schedule; pass it to skip a lookup
+                    # The message row is committed together with the schedule's final status
+                    result = messaging.send_to_contact(sched.contact or sched.contact_id, sched.message, commit=False)
                     success = result.get('success', False)
                 else:
-                    result = messaging.send_to_contact(sched.phone_number, sched.message)
+                    result = messaging.send_to_contact(sched.phone_number, sched.message, commit=False)
                     success = result.get('success', False)
             elif sched.type == 'group':
                 results = messaging.send_bulk_by_group(sched.group_id, sched.message, sleep_between_secs=3.0)
@@ -136,20 +233,16 @@ def run_send_job(scheduled_id: int) -> None:
             else:
                 success = False
 
-            sched.last_run_at = datetime.utcnow()
+            sched.last_run_at = utcnow()
             if sched.schedule_type == 'once':
+                # APScheduler already dropped the date job from its store when it fired
                 sched.status = 'completed' if success else 'failed'
-                # Remove job after completion
-                try:
-                    if scheduler:
-                        scheduler.remove_job(sched.job_id)
-                except Exception:
-                    logger.warning(f"Could not remove job {sched.job_id} after completion")
             # For cron jobs, keep as scheduled
             db.session.commit()
         except Exception:
             logger.exception(f"Error executing scheduled job {sched.id}")
-            sched.last_run_at = datetime.utcnow()
+            db.session.rollback()
+            sched.last_run_at = utcnow()
             if sched.schedule_type == 'once':
                 sched.status = 'failed'
             db.session.commit()
@@ -220,9 +313,12 @@ def schedule_message_cron(
     return sched.to_dict()
 
 
-def list_schedules() -> List[Dict[str, Any]]:
-    items = ScheduledMessage.query.order_by(ScheduledMessage.created_at.desc()).all()
-    return [i.to_dict() for i in items]
+def list_schedules(limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    """Schedules newest first; served by the created_at index when limited."""
+    query = ScheduledMessage.query.order_by(ScheduledMessage.created_at.desc(), ScheduledMessage.id.desc())
+    if limit is not None:
+        query = query.limit(limit).offset(offset)
+    return [i.to_dict() for i in query.all()]
 
 
 def update_schedule(
@@ -260,7 +356,7 @@ def update_schedule(
     if sched.schedule_type == 'once':
         if run_at is not None:
             sched.run_at = run_at
-        if not sched.run_at or sched.run_at <= datetime.utcnow():
+        if not sched.run_at or sched.run_at <= utcnow():
             raise ValueError('run_at must be a future datetime for one-time schedules')
     else:
         if cron_expression is not None:
@@ -365,7 +461,7 @@ def resume_schedule(schedule_id: int) -> bool:
                 # If not present, re-add depending on type
                 if sched.schedule_type == 'cron' and sched.cron_expression:
                     _add_cron_job(sched)
-                elif sched.schedule_type == 'once' and sched.run_at and sched.run_at > datetime.utcnow():
+                elif sched.schedule_type == 'once' and sched.run_at and sched.run_at > utcnow():
                     _add_date_job(sched)
                 else:
                     # Cannot resume an expired one-time schedule
@@ -375,7 +471,7 @@ def resume_schedule(schedule_id: int) -> bool:
             # No scheduler or job id; try to re-add
             if sched.schedule_type == 'cron' and sched.cron_expression:
                 _add_cron_job(sched)
-            elif sched.schedule_type == 'once' and sched.run_at and sched.run_at > datetime.utcnow():
+            elif sched.schedule_type == 'once' and sched.run_at and sched.run_at > utcnow():
                 _add_date_job(sched)
             else:
                 logger.warning(f"Cannot resume schedule {schedule_id}: invalid timing or missing trigger")
@@ -1,4 +1,5 @@
-from typing import Optional, Dict, Any, List
+import threading
+from typing import Optional, Dict, Any, List, Tuple
 from flask import current_app
 from sqlalchemy.exc import SQLAlchemyError
 from models import db, Setting
@@ -11,19 +12,22 @@ ZAPI_KEYS = [
     'ZAPI_CLIENT_TOKEN',
 ]
 
+# Bumped by set_settings; the resolved Z-API config is reused until it changes
+_revision = 0
+_revision_lock = threading.Lock()
+_zapi_config: Tuple[int, Optional[Dict[str, Optional[str]]]] = (-1, None)
+
 def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
     s = Setting.query.filter_by(key=key).first()
     return s.value if s else default
 
 
 def set_settings(data: Dict[str, Any]) -> None:
-    for k, v in data.items():
-        s = Setting.query.filter_by(key=k).first()
-        if s:
-            s.value = v
-        else:
-            db.session.add(Setting(key=k, value=v))
+    Setting.upsert_many(data)
     db.session.commit()
+    global _revision
+    with _revision_lock:
+        _revision += 1
 
 
 def get_settings(keys: Optional[List[str]] = None) -> Dict[str, Optional[str]]:
@@ -39,7 +43,22 @@ def get_settings(keys: Optional[List[str]] = None) -> Dict[str, Optional[str]]:
 
 
 def get_effective_zapi_config() -> Dict[str, Optional[str]]:
-    """Get runtime Z-API config preferring DB settings, fallback to env Config."""
+    """Get runtime Z-API config preferring DB settings, fallback to env Config.
+
+    Resolved once per settings revision; bulk sends call this for every message.
+    """
+    global _zapi_config
+    rev, cfg = _zapi_config
+    if rev == _revision and cfg is not None:
+        return dict(cfg)
+    # Read the revision before the settings so a concurrent write forces a re-read
+    rev = _revision
+    cfg = _resolve_zapi_config()
+    _zapi_config = (rev, cfg)
+    return dict(cfg)
+
+
+def _resolve_zapi_config() -> Dict[str, Optional[str]]:
     db_vals = get_settings(ZAPI_KEYS)
     instance_id = db_vals.get('ZAPI_INSTANCE_ID') or Config.ZAPI_INSTANCE_ID
     instance_token = db_vals.get('ZAPI_INSTANCE_TOKEN') or Config.ZAPI_INSTANCE_TOKEN
@@ -57,4 +76,10 @@ def get_effective_zapi_config() -> Dict[str, Optional[str]]:
         'instance_token': instance_token,
         'send_text_url': send_text_url,
         'client_token': client_token,
+        # Display form for the dashboard, built once per settings revision
+        'masked_instance_id': _mask(instance_id),
     }
+
+
+def _mask(value: Optional[str]) -> Optional[str]:
+    return value[:4] + '...' + value[-4:] if value else None
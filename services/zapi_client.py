@@ -1,12 +1,48 @@
 import requests
-import json
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from requests.adapters import HTTPAdapter
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from urllib3.util import Retry
 from loguru import logger
 from config import Config
 from services.settings_service import get_effective_zapi_config
 
-# Configure logger
-logger.add("logs/app.log", rotation="10 MB", retention="30 days", level="INFO")
+# Provider answers meaning the request was not processed: rate limited, unavailable.
+# 502/504 come back after the request reached Z-API, so a retry could send twice.
+_RETRY_STATUSES = frozenset({429, 503})
+
+# Retried inside the adapter so the payload, headers and config aren't rebuilt per attempt.
+# Read errors are not retried: the send may already have been delivered.
+_RETRY = Retry(
+    total=3,
+    connect=3,
+    read=0,
+    status=3,
+    backoff_factor=1,
+    status_forcelist=_RETRY_STATUSES,
+    allowed_methods=frozenset(['POST']),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+# One keep-alive pool for all Z-API traffic so consecutive sends skip the TCP/TLS handshake
+_SESSION = requests.Session()
+_SESSION.headers["Accept"] = "application/json"
+_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=_RETRY)
+_SESSION.mount("https://", _adapter)
+_SESSION.mount("http://", _adapter)
+
+# Dashboard probes are read-only and interactive: one immediate retry on a failed
+# connect, none on status codes, so a degraded Z-API can't stall the overview with backoff
+_PROBE_RETRY = Retry(total=1, connect=1, read=0, status=0, backoff_factor=0)
+_PROBE_SESSION = requests.Session()
+_PROBE_SESSION.headers["Accept"] = "application/json"
+_probe_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=_PROBE_RETRY)
+_PROBE_SESSION.mount("https://", _probe_adapter)
+_PROBE_SESSION.mount("http://", _probe_adapter)
+
+# Dashboard probes, in the order get_overview unpacks them
+_OVERVIEW_PATHS = ('/status', '/device', '/webhook', '/qrcode')
 
 class ZAPIClient:
     """Client for Z-API WhatsApp integration."""
@@ -18,8 +54,9 @@ class ZAPIClient:
     def _effective(self):
         return get_effective_zapi_config()
     
-    def _base_url(self) -> str:
-        cfg = self._effective()
+    def _base_url(self, cfg=None) -> str:
+        if cfg is None:
+            cfg = self._effective()
         send_url = cfg.get('send_text_url') or ''
         if send_url.endswith('/send-text'):
             return send_url[: -len('/send-text')]
@@ -29,23 +66,26 @@ class ZAPIClient:
             return f"https://api.z-api.io/instances/{iid}/token/{tok}"
         return ''
     
-    def _headers(self):
-        cfg = self._effective()
-        h = {"Accept": "application/json"}
+    def _headers(self, cfg=None):
+        if cfg is None:
+            cfg = self._effective()
+        h = {}
         if cfg.get('client_token'):
+            # Some servers may look for lowercase header keys; send both just in case
             h["Client-Token"] = cfg['client_token']
             h["client-token"] = cfg['client_token']
         return h
     
     def get_overview(self, timeout=10):
         """Aggregate basic dashboard info from Z-API. Best-effort; degrades gracefully."""
-        base = self._base_url()
+        # Resolve settings once and hand them to the helpers
         cfg = self._effective()
+        base = self._base_url(cfg)
         result = {
             "success": True,
             "configured": bool(base),
             "config": {
-                "instance_id": (cfg.get('instance_id') or '')[:4] + '...' + (cfg.get('instance_id') or '')[-4:] if cfg.get('instance_id') else None,
+                "instance_id": cfg.get('masked_instance_id'),
                 "send_text_url_set": bool(cfg.get('send_text_url')),
             },
             "status": None,
@@ -58,35 +98,32 @@ class ZAPIClient:
             result["success"] = False
             result["errors"]["base"] = "Z-API não configurada"
             return result
-        sesh = requests.Session()
-        headers = self._headers()
+        headers = self._headers(cfg)
         def safe_get(path):
             try:
-                r = sesh.get(base + path, headers=headers, timeout=timeout)
+                r = _PROBE_SESSION.get(base + path, headers=headers, timeout=timeout)
                 try:
-                    data = r.json()
+                    data = orjson.loads(r.content)
                 except Exception:
                     data = {"raw_text": r.text}
                 return {"ok": r.status_code in range(200,300), "status": r.status_code, "data": data}
             except Exception as e:
                 return {"ok": False, "status": 0, "error": str(e)}
-        # Try endpoints
-        status = safe_get('/status')
+        # Try endpoints; the probes are independent, so wait for the slowest rather than the sum
+        with ThreadPoolExecutor(max_workers=len(_OVERVIEW_PATHS)) as pool:
+            status, device, webhook, qrcode = pool.map(safe_get, _OVERVIEW_PATHS)
         if status.get('ok'):
             result['status'] = status['data']
         else:
             result['errors']['status'] = status.get('error') or status.get('status')
-        device = safe_get('/device')
         if device.get('ok'):
             result['device'] = device['data']
         else:
             result['errors']['device'] = device.get('error') or device.get('status')
-        webhook = safe_get('/webhook')
         if webhook.get('ok'):
             result['webhook'] = webhook['data']
         else:
             result['errors']['webhook'] = webhook.get('error') or webhook.get('status')
-        qrcode = safe_get('/qrcode')
         if qrcode.get('ok'):
             # Different keys across providers – try to normalize
             data = qrcode['data']
@@ -96,11 +133,6 @@ class ZAPIClient:
             result['errors']['qrcode'] = qrcode.get('error') or qrcode.get('status')
         return result
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((requests.ConnectionError, requests.Timeout))
-    )
     def send_text(self, phone_e164, message, timeout=30):
         """
         Send a text message via Z-API.
@@ -121,7 +153,7 @@ class ZAPIClient:
         """
         try:
             # Resolve effective configuration
-            cfg = get_effective_zapi_config()
+            cfg = self._effective()
             send_url = cfg.get('send_text_url')
             if not send_url:
                 return {
@@ -137,32 +169,21 @@ class ZAPIClient:
                 "message": message
             }
             
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            }
-            # Optional client token header
-            if cfg.get('client_token'):
-                # Some servers may look for lowercase header keys; send both just in case
-                headers["Client-Token"] = cfg['client_token']
-                headers["client-token"] = cfg['client_token']
+            # Optional client token header; the body is pre-encoded, so declare its type
+            headers = self._headers(cfg)
+            headers["Content-Type"] = "application/json"
             
             logger.info(f"Sending message to {phone_e164[:4]}...{phone_e164[-4:]}")
             
-            # Make the request
-            response = requests.post(
-                send_url,
-                json=payload,
-                headers=headers,
-                timeout=timeout
-            )
+            # Make the request; transient failures are retried by the adapter before a result is recorded
+            response = _SESSION.post(send_url, data=orjson.dumps(payload), headers=headers, timeout=timeout)
             
             # Parse response
             http_status = response.status_code
             
             try:
-                response_data = response.json()
-            except json.JSONDecodeError:
+                response_data = orjson.loads(response.content)
+            except orjson.JSONDecodeError:
                 response_data = {"raw_text": response.text}
             
             # Handle success (2xx status codes)
@@ -230,12 +251,9 @@ class ZAPIClient:
                 "error": error_msg
             }
 
-# Singleton instance
-_client = None
+# Singleton instance; built at import since settings are resolved per call, not held
+_client = ZAPIClient()
 
 def get_client():
-    """Get or create the Z-API client singleton."""
-    global _client
-    if _client is None:
-        _client = ZAPIClient()
+    """Get the Z-API client singleton."""
     return _client
\ No newline at end of file
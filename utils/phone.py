@@ -1,5 +1,12 @@
-import phonenumbers
-from phonenumbers import NumberParseException
+import re
+from functools import lru_cache
+
+# Already-normalized Brazilian numbers: 55 + a valid area code + a mobile (9 + 8 digits)
+# or landline (8 digits) subscriber number. Accepts exactly what phonenumbers validates.
+_E164_BR = re.compile(
+    r'55(?:1[1-9]|2[12478]|3[1-578]|4[1-9]|5[1345]|6[1-9]|7[134579]|8[1-9]|9[1-9])'
+    r'(?:9\d{8}|[2-57]\d{7})'
+)
 
 def normalize_to_e164(number, default_region='BR'):
     """
@@ -15,12 +22,39 @@ def normalize_to_e164(number, default_region='BR'):
     Raises:
         ValueError: If the number is invalid
     """
+    normalized, error = try_normalize_to_e164(number, default_region)
+    if error:
+        raise ValueError(error)
+    return normalized
+
+def try_normalize_to_e164(number, default_region='BR'):
+    """
+    Non-raising variant of normalize_to_e164, for callers that expect invalid input.
+    
+    Returns:
+        Tuple of (normalized digits, None) or (None, error message)
+    """
     if not number:
-        raise ValueError("Phone number cannot be empty")
+        return None, "Phone number cannot be empty"
     
     # Remove common formatting characters
     number = number.strip()
     
+    # Stored contacts are already normalized; skip phonenumbers for them
+    digits = number[1:] if number.startswith('+') else number
+    if _E164_BR.fullmatch(digits):
+        return digits, None
+    
+    return _normalize_stripped(number, default_region)
+
+# phonenumbers metadata is fixed per package version, so results never go stale;
+# failures are returned rather than raised so repeated bad input is cached too
+@lru_cache(maxsize=4096)
+def _normalize_stripped(number, default_region):
+    # Imported on first use: the metadata is large and the fast path above usually suffices
+    import phonenumbers
+    from phonenumbers import NumberParseException
+    
     # If number doesn't start with +, try to parse with default region
     if not number.startswith('+'):
         try:
@@ -30,21 +64,22 @@ def normalize_to_e164(number, default_region='BR'):
             try:
                 parsed = phonenumbers.parse('+' + number, None)
             except NumberParseException as e:
-                raise ValueError(f"Invalid phone number: {e}")
+                return None, f"Invalid phone number: {e}"
     else:
         try:
             parsed = phonenumbers.parse(number, None)
         except NumberParseException as e:
-            raise ValueError(f"Invalid phone number: {e}")
+            return None, f"Invalid phone number: {e}"
     
     # Validate the number
     if not phonenumbers.is_valid_number(parsed):
-        raise ValueError(f"Invalid phone number for region: {number}")
+        return None, f"Invalid phone number for region: {number}"
     
     # Format to E.164 and remove the '+' prefix
     e164_number = phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
-    return e164_number.lstrip('+')
+    return e164_number.lstrip('+'), None
 
+@lru_cache(maxsize=4096)
 def format_for_display(number, default_region='BR'):
     """
     Format a phone number for display.
@@ -56,6 +91,9 @@ def format_for_display(number, default_region='BR'):
     Returns:
         Formatted phone number string for display
     """
+    import phonenumbers
+    from phonenumbers import NumberParseException
+    
     try:
         # Add '+' if it's E.164 without it
         if number and number[0].isdigit() and len(number) > 10:
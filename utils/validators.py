@@ -1,84 +1,102 @@
-from marshmallow import Schema, fields, ValidationError, validates, validates_schema
-from utils.phone import normalize_to_e164
+from marshmallow import Schema, fields, ValidationError, post_load
+from marshmallow.validate import OneOf
+from utils.phone import try_normalize_to_e164
+
+_MAX_NAME_LENGTH = 100
+_MAX_MESSAGE_LENGTH = 4096  # WhatsApp message limit
+_NAME_TOO_LONG = f'Name cannot exceed {_MAX_NAME_LENGTH} characters'
+_MESSAGE_TOO_LONG = f'Message cannot exceed {_MAX_MESSAGE_LENGTH} characters'
+
+# Schedule type -> (fields of which at least one must be set, error if none is)
+_SCHEDULE_TARGETS = {
+    'individual': (('contact_id', 'phone'), 'For individual type, provide contact_id or phone'),
+    'group': (('group_id',), 'For group type, provide group_id'),
+}
+# schedule_type -> (required field, error if missing)
+_SCHEDULE_KINDS = {
+    'once': ('run_at', 'run_at is required for one-time schedules'),
+    'cron': ('cron', 'cron expression is required for cron schedules'),
+}
+
+def _validate_name(value):
+    """Contact name check: non-blank and at most _MAX_NAME_LENGTH characters."""
+    if len(value) > _MAX_NAME_LENGTH:
+        raise ValidationError(_NAME_TOO_LONG)
+    if not value or value.isspace():
+        raise ValidationError('Name cannot be empty')
+
+def _validate_message(value):
+    """Shared message body check: non-blank and within the WhatsApp length limit."""
+    if len(value) > _MAX_MESSAGE_LENGTH:
+        raise ValidationError(_MESSAGE_TOO_LONG)
+    if not value or value.isspace():
+        raise ValidationError('Message cannot be empty')
+
+class PhoneNumber(fields.Str):
+    """String field that deserializes to normalized E.164 digits, normalizing once.
+
+    An empty string is passed through for optional fields; required ones reject it.
+    """
+    
+    def _deserialize(self, value, attr, data, **kwargs):
+        value = super()._deserialize(value, attr, data, **kwargs)
+        if not value and not self.required:
+            return value
+        normalized, error = try_normalize_to_e164(value)
+        if error:
+            raise ValidationError(error)
+        return normalized
+
+class LowerStr(fields.Str):
+    """String field deserialized to lowercase, so choices match case-insensitively."""
+    
+    def _deserialize(self, value, attr, data, **kwargs):
+        return super()._deserialize(value, attr, data, **kwargs).lower()
 
 class ContactSchema(Schema):
     """Schema for validating contact data."""
-    name = fields.Str(required=True, error_messages={
+    name = fields.Str(required=True, validate=_validate_name, error_messages={
         'required': 'Contact name is required'
     })
-    whatsapp_number = fields.Str(required=True, error_messages={
+    whatsapp_number = PhoneNumber(required=True, error_messages={
         'required': 'WhatsApp number is required'
     })
     group_id = fields.Int(required=False, allow_none=True)
-    
-    @validates('name')
-    def validate_name(self, value):
-        if not value or not value.strip():
-            raise ValidationError('Name cannot be empty')
-        if len(value) > 100:
-            raise ValidationError('Name cannot exceed 100 characters')
-    
-    @validates('whatsapp_number')
-    def validate_whatsapp_number(self, value):
-        try:
-            # Normalize the phone number
-            normalized = normalize_to_e164(value)
-            return normalized
-        except ValueError as e:
-            raise ValidationError(str(e))
 
 class MessageSchema(Schema):
     """Schema for validating message data."""
     contact_id = fields.Int(required=False, allow_none=True)
-    phone = fields.Str(required=False, allow_none=True)
-    message = fields.Str(required=True, error_messages={
+    phone = PhoneNumber(required=False, allow_none=True)
+    message = fields.Str(required=True, validate=_validate_message, error_messages={
         'required': 'Message content is required'
     })
     
-    @validates_schema
+    @post_load
     def validate_recipient(self, data, **kwargs):
         if not data.get('contact_id') and not data.get('phone'):
             raise ValidationError(
                 'Either contact_id or phone number must be provided'
             )
-    
-    @validates('phone')
-    def validate_phone(self, value):
-        if value:
-            try:
-                normalized = normalize_to_e164(value)
-                return normalized
-            except ValueError as e:
-                raise ValidationError(str(e))
-    
-    @validates('message')
-    def validate_message(self, value):
-        if not value or not value.strip():
-            raise ValidationError('Message cannot be empty')
-        if len(value) > 4096:  # WhatsApp message limit
-            raise ValidationError('Message cannot exceed 4096 characters')
+        return data
 
 class BulkMessageSchema(Schema):
     """Schema for validating bulk message data."""
     group_id = fields.Int(required=True, error_messages={
         'required': 'Group ID is required for bulk sending'
     })
-    message = fields.Str(required=True, error_messages={
+    message = fields.Str(required=True, validate=_validate_message, error_messages={
         'required': 'Message content is required'
     })
-    
-    @validates('message')
-    def validate_message(self, value):
-        if not value or not value.strip():
-            raise ValidationError('Message cannot be empty')
-        if len(value) > 4096:
-            raise ValidationError('Message cannot exceed 4096 characters')
 
 class ScheduleSchema(Schema):
     """Schema for validating schedule requests."""
-    type = fields.Str(required=True)  # 'individual' or 'group'
-    schedule_type = fields.Str(required=True)  # 'once' or 'cron'
-    message = fields.Str(required=True)
+    type = LowerStr(required=True, validate=OneOf(
+        _SCHEDULE_TARGETS, error='type must be "individual" or "group"'
+    ))
+    schedule_type = LowerStr(required=True, validate=OneOf(
+        _SCHEDULE_KINDS, error='schedule_type must be "once" or "cron"'
+    ))
+    message = fields.Str(required=True, validate=_validate_message)
 
     # Individual
     contact_id = fields.Int(required=False, allow_none=True)
@@ -91,26 +109,12 @@ class ScheduleSchema(Schema):
     run_at = fields.Str(required=False, allow_none=True)  # ISO string from client
     cron = fields.Str(required=False, allow_none=True)
 
-    @validates_schema
+    @post_load
     def validate_schedule(self, data, **kwargs):
-        t = (data.get('type') or '').lower()
-        st = (data.get('schedule_type') or '').lower()
-
-        if t not in ('individual', 'group'):
-            raise ValidationError('type must be "individual" or "group"')
-        if st not in ('once', 'cron'):
-            raise ValidationError('schedule_type must be "once" or "cron"')
-
-        if t == 'individual':
-            if not data.get('contact_id') and not data.get('phone'):
-                raise ValidationError('For individual type, provide contact_id or phone')
-        elif t == 'group':
-            if not data.get('group_id'):
-                raise ValidationError('For group type, provide group_id')
-
-        if st == 'once':
-            if not data.get('run_at'):
-                raise ValidationError('run_at is required for one-time schedules')
-        elif st == 'cron':
-            if not data.get('cron'):
-                raise ValidationError('cron expression is required for cron schedules')
+        keys, error = _SCHEDULE_TARGETS[data['type']]
+        if not any(data.get(k) for k in keys):
+            raise ValidationError(error)
+        key, error = _SCHEDULE_KINDS[data['schedule_type']]
+        if not data.get(key):
+            raise ValidationError(error)
+        return data